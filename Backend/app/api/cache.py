@@ -1,2 +1,9 @@
 # app/services/cache.py
-datasets_cache = {}
+from app.services.dataset_cache import DatasetCache
+from app.services.quality_memo import QualityCurveMemo
+
+datasets_cache = DatasetCache()
+quality_memo = QualityCurveMemo()
+
+# Curves of an evicted dataset would be recomputed from new projections anyway
+datasets_cache.on_evict(lambda name, dataset: quality_memo.invalidate(name))
@@ -11,10 +11,17 @@ from app.database import get_db
 from app.dependencies import get_current_user
 
 from app.models.models import *
+from app.api.websocket import safe_notify_clients
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+
+def _notify_forum(event_type: str, key: str = None, **fields):
+    # Published on the event bus, so clients on every worker see forum activity
+    safe_notify_clients({"type": event_type, **fields}, key=key, channel="forum")
+
+
 # Post endpoints
 from sqlalchemy import func
 
@@ -54,6 +61,7 @@ def create_thread(thread: ThreadCreate, db: Session = Depends(get_db), current_u
     db.add(db_thread)
     db.commit()
     db.refresh(db_thread)
+    _notify_forum("thread_created", thread_id=db_thread.id)
     
     return db_thread
 
@@ -69,6 +77,8 @@ def like_thread(thread_id: int, db: Session = Depends(get_db), current_user: Use
     db_thread.likes_count += 1
     db.commit()
     db.refresh(db_thread)
+    _notify_forum("thread_liked", key=f"thread_liked:{thread_id}", thread_id=thread_id,
+                  likes_count=db_thread.likes_count)
 
     return db_thread
 
@@ -91,6 +101,7 @@ def create_comment(comment: CommentCreate, db: Session = Depends(get_db), curren
     db.add(db_comment)
     db.commit()
     db.refresh(db_comment)
+    _notify_forum("comment_created", thread_id=db_comment.thread_id, comment_id=db_comment.id)
     
     return db_comment
 
@@ -111,6 +122,7 @@ def update_post(post_id: int, post_update: PostUpdate, db: Session = Depends(get
     post.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(post)
+    _notify_forum("post_updated", post_id=post.id)
     
     return PostResponse(
         id=post.id,
@@ -135,6 +147,7 @@ def delete_post(post_id: int, db: Session = Depends(get_db), current_user: User
     
     db.delete(post)
     db.commit()
+    _notify_forum("post_deleted", post_id=post_id)
     return {"message": "Post deleted successfully"}
 
 # Reply endpoints
@@ -186,6 +199,7 @@ def create_reply(
     db.add(db_reply)
     db.commit()
     db.refresh(db_reply)
+    _notify_forum("reply_created", post_id=post_id, reply_id=db_reply.id)
 
     # Prepare the response. You might need to eagerly load 'author' and 'referenced_reply'
     # if they are not already loaded by default for your ORM.
@@ -237,6 +251,7 @@ def update_reply(reply_id: int, reply_update: ReplyUpdate, db: Session = Depends
     reply.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(reply)
+    _notify_forum("reply_updated", post_id=reply.post_id, reply_id=reply.id)
     
     return ReplyResponse(
         id=reply.id,
@@ -258,8 +273,10 @@ def delete_reply(reply_id: int, db: Session = Depends(get_db), current_user: Use
     if reply.author_id != current_user.id: # Use current_user.id for authorization check
         raise HTTPException(status_code=403, detail="Not authorized to delete this reply")
     
+    post_id = reply.post_id  # expired with the row once the delete is committed
     db.delete(reply)
     db.commit()
+    _notify_forum("reply_deleted", post_id=post_id, reply_id=reply_id)
     return {"message": "Reply deleted successfully"}
 
 # Reaction endpoints
@@ -1,81 +1,398 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from typing import List, Optional
 from app.dependencies import get_current_user
 from app.services.dataset_store import Dataset
-from app.api.cache import datasets_cache
+from app.api.cache import datasets_cache, quality_memo
+from app.services import projection_store, wire_format
+from app.services.projection_engine import projection_engine
+from app.services.session_store import dataset_sessions
 import pandas as pd
+import numpy as np
+import io
 import os
 import asyncio
 import contextlib
+import hashlib
+import re
+import copy
 from app.api.websocket import safe_notify_clients_projection_ready
 
 router = APIRouter()
 
 DATASET_FOLDER = "Datasets"
-current_dataset_filename = None  # Tracks currently loaded dataset filename
+# Default for new datasets: compute every projection up front, or only on request
+LAZY_PROJECTIONS = os.getenv("LAZY_PROJECTIONS", "0") == "1"
 dataset_tasks = {}  # Tracks running async projection tasks
+PROJECTION_SET_KEY = re.compile(r"[0-9a-f]{64}")
 
 
-@router.get("/dataset/{namefile:path}")
-async def get_dataset(namefile: str, current_user=Depends(get_current_user)):
-    global current_dataset_filename
+def _forget_task(name, dataset):
+    # Evicted datasets are cancelled by the cache; their task finishes on its own
+    dataset_tasks.pop(name, None)
 
-    # Normalize and secure the filename
+
+datasets_cache.on_evict(_forget_task)
+# Datasets some user still holds stay resident
+datasets_cache.keep_if(dataset_sessions.is_held)
+
+
+def _release(name):
+    """Runs once no session references the dataset anymore."""
+    dataset = datasets_cache.peek(name)
+    if dataset is None or dataset.ready or (dataset.lazy and dataset.has_projections()):
+        # Finished datasets, and lazy ones with fits worth keeping, stay in the
+        # LRU cache for whoever asks next
+        return
+    # A cancelled dataset can't resume, so drop it and let the next request start over
+    dataset.cancel()
+    datasets_cache.pop(name, None)
+    dataset_tasks.pop(name, None)
+    quality_memo.invalidate(name)
+    print(f"Cancelled {name}: no session holds it anymore")
+
+
+@router.get("/jobs")
+async def get_projection_jobs(current_user=Depends(get_current_user)):
+    """Queued and running projection jobs, including how many job processes are alive."""
+    return projection_engine.stats()
+
+
+@router.get("/cache")
+async def get_cache_entries(current_user=Depends(get_current_user)):
+    """Resident datasets with their byte sizes, most recently used first."""
+    return {
+        "budget_bytes": datasets_cache.budget_bytes,
+        "total_bytes": datasets_cache.total_bytes(),
+        "entries": datasets_cache.entries()
+    }
+
+
+@router.post("/cache/{namefile}/pin")
+async def pin_dataset(namefile: str, current_user=Depends(get_current_user)):
+    """Keeps a loaded dataset resident regardless of the memory budget."""
+    filename = _normalize_filename(namefile)
+    try:
+        datasets_cache.pin(filename)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Dataset '{filename}' not found in cache.")
+    return {"message": f"Dataset '{filename}' pinned."}
+
+
+@router.delete("/cache/{namefile}/pin")
+async def unpin_dataset(namefile: str, current_user=Depends(get_current_user)):
+    filename = _normalize_filename(namefile)
+    datasets_cache.unpin(filename)
+    datasets_cache.enforce_budget()
+    return {"message": f"Dataset '{filename}' unpinned."}
+
+
+@router.get("/dataset/session")
+async def get_dataset_session(current_user=Depends(get_current_user)):
+    """Datasets the current user holds, with how many users share each one."""
+    return {
+        "datasets": [
+            {"name": name, "holders": dataset_sessions.refcount(name)}
+            for name in dataset_sessions.held_by(current_user.id)
+        ]
+    }
+
+
+@router.delete("/dataset/session/{namefile}")
+async def release_dataset(namefile: str, current_user=Depends(get_current_user)):
+    """Lets go of a dataset; its computation stops if nobody else holds it."""
+    filename = _normalize_filename(namefile)
+    if dataset_sessions.release(current_user.id, filename):
+        _release(filename)
+    return {"message": f"Dataset '{filename}' released."}
+
+
+def _normalize_filename(namefile: str) -> str:
     filename = os.path.basename(namefile)
     if not filename.endswith(".csv"):
         filename += ".csv"
+    return filename
+
+
+def _status(dataset) -> str:
+    if dataset.ready:
+        return "ready"
+    return "lazy" if dataset.lazy else "processing"
+
+
+def _dataset_response(dataset) -> dict:
+    status = _status(dataset)
+    return {
+        "X": dataset.X.tolist(),
+        "y": dataset.y,
+        # While processing, don't return incomplete projections (see /projections for those)
+        "projections": dataset.projections_payload() if status != "processing" else {"status": "processing"},
+        "jobs": dataset.jobs,
+        "approximate": dataset.approximate,
+        "status": status,
+        "projections_url": _projection_set_url(dataset)
+    }
+
+
+def _projections_response(dataset) -> dict:
+    return {
+        "status": _status(dataset),
+        "projections": dataset.projections_payload(),
+        "jobs": dataset.jobs,
+        "approximate": dataset.approximate,
+        "projections_url": _projection_set_url(dataset)
+    }
+
+
+def _projection_set_url(dataset) -> Optional[str]:
+    """
+    Immutable URL of the projection set, once it holds every pair. A set with
+    gaps gets none, since a later run may still fill them in.
+    """
+    if not dataset.ready or not dataset.cache_key or not projection_store.is_complete(dataset.projections):
+        return None
+    return f"/dataset/projection-sets/{dataset.cache_key}"
+
+
+def _etag(*parts) -> str:
+    return '"' + ".".join(parts) + '"'
+
+
+def _format_tag(media_type: str) -> str:
+    # Each representation of a resource needs its own strong ETag
+    return hashlib.sha256(media_type.encode()).hexdigest()[:8]
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so ignore W/ prefixes
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+
+def _binary_parts(dataset, include_data: bool):
+    """Same content as the JSON responses, with X, projections and labels as packed buffers."""
+    status = _status(dataset)
+    # Snapshot on the event loop: projections and job statuses keep changing while encoding
+    meta = copy.deepcopy({"status": status, "jobs": dataset.jobs, "approximate": dataset.approximate})
+    meta["projections_url"] = _projection_set_url(dataset)
+    arrays = {"X": dataset.X} if include_data else {}
+    if include_data and status == "processing":
+        meta["projections"] = "processing"
+    else:
+        for mix_type, dims in dataset.projections.items():
+            for dim, stack in dims.items():
+                for algo_name, data in stack.items():
+                    arrays[f"projections/{mix_type}/{dim}/{algo_name}"] = data
+    labels = (dataset.label_codes, dataset.label_names) if include_data else None
+    return meta, arrays, labels
+
+
+def _negotiate(request: Request) -> str:
+    media_type = wire_format.negotiate(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(
+            status_code=406,
+            detail=f"Supported media types: {', '.join(wire_format.available_media_types())}"
+        )
+    return media_type
+
+
+async def _respond(request: Request, dataset, media_type: str, include_data: bool = True) -> Response:
+    """
+    JSON by default; a packed binary encoding when the Accept header asked for one.
+    Clients revalidate with If-None-Match and get a 304 while nothing has changed.
+    """
+    resource = "dataset" if include_data else "projections"
+    etag = _etag(dataset.cache_key or dataset.name, resource, dataset.version, _format_tag(media_type))
+    headers = {"Vary": "Accept", "ETag": etag, "Cache-Control": "private, no-cache"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    if media_type == wire_format.JSON:
+        body = _dataset_response(dataset) if include_data else _projections_response(dataset)
+        return JSONResponse(body, headers=headers)
+    # Large payloads take a while to pack, so keep it off the event loop
+    content = await asyncio.to_thread(wire_format.encode, media_type, *_binary_parts(dataset, include_data))
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+def _resident_projection_set(key: str):
+    """Projections of a complete resident dataset with this content key, if any."""
+    for name in datasets_cache:
+        dataset = datasets_cache.peek(name)
+        if dataset is not None and dataset.ready and dataset.cache_key == key \
+                and projection_store.is_complete(dataset.projections):
+            return dataset.projections
+    return None
+
+
+@router.get("/projection-sets/{key}")
+async def get_projection_set(request: Request, key: str, current_user=Depends(get_current_user)):
+    """
+    A complete projection set addressed by its content key. The content behind a
+    key never changes, so browsers and proxies may cache it indefinitely; partial
+    sets are never served here.
+    """
+    if not PROJECTION_SET_KEY.fullmatch(key):
+        raise HTTPException(status_code=404, detail="Unknown projection set")
+    media_type = _negotiate(request)
+    etag = _etag(key, _format_tag(media_type))
+    headers = {"Vary": "Accept", "ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    projections = _resident_projection_set(key)
+    if projections is None:
+        # Evicted or from an earlier run
+        stored = await asyncio.to_thread(projection_store.load, key)
+        projections = stored[0] if stored and projection_store.is_complete(stored[0]) else None
+    if projections is None:
+        raise HTTPException(status_code=404, detail="Unknown projection set")
+
+    if media_type == wire_format.JSON:
+        body = {
+            "key": key,
+            "projections": {
+                mix_type: {dim: {algo_name: np.asarray(data).tolist() for algo_name, data in algos.items()}
+                           for dim, algos in dims.items()}
+                for mix_type, dims in projections.items()
+            }
+        }
+        return JSONResponse(body, headers=headers)
+    arrays = {
+        f"projections/{mix_type}/{dim}/{algo_name}": data
+        for mix_type, dims in projections.items()
+        for dim, algos in dims.items()
+        for algo_name, data in algos.items()
+    }
+    content = await asyncio.to_thread(wire_format.encode, media_type, {"key": key}, arrays)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+def _hold(user_id, filename, keep_others):
+    # Switching datasets releases the user's previous ones unless asked to keep them
+    for name in dataset_sessions.hold(user_id, filename, exclusive=not keep_others):
+        _release(name)
+    # Holds of users who stopped asking lapse here too
+    for name in dataset_sessions.expire():
+        _release(name)
+
+
+# Declared before the catch-all dataset route, whose path parameter would otherwise swallow "/projections"
+@router.get("/dataset/{namefile:path}/projections")
+async def get_dataset_projections(
+    request: Request,
+    namefile: str,
+    mix_by: Optional[str] = None,
+    dimension: Optional[str] = None,
+    algorithms: Optional[List[str]] = Query(None),
+    current_user=Depends(get_current_user)
+):
+    filename = _normalize_filename(namefile)
+    media_type = _negotiate(request)
+
+    if filename not in datasets_cache:
+        raise HTTPException(status_code=404, detail=f"Dataset '{filename}' not found in cache.")
+
+    dataset = datasets_cache[filename]
+    dataset_sessions.touch(current_user.id, filename)
+
+    # Projections named in the query are computed now (lazy) or next (eager)
+    if mix_by and dimension and algorithms:
+        await dataset.request_projections(mix_by.lower(), dimension.lower(), algorithms)
+
+    # While computing, return whatever subset of projections is already done
+    return await _respond(request, dataset, media_type, include_data=False)
+
+
+@router.get("/dataset/{namefile:path}/subsample")
+async def get_dataset_subsample(
+    request: Request,
+    namefile: str,
+    n: int = Query(2000, ge=1),
+    start: int = Query(0, ge=0),
+    mix_by: Optional[str] = None,
+    dimension: Optional[str] = None,
+    algorithms: Optional[List[str]] = Query(None),
+    current_user=Depends(get_current_user)
+):
+    """
+    At most n points of a loaded dataset, stratified by label, for thumbnails and
+    zoomed-out views. Indices are stable: asking again with start set to the
+    previous n returns only the points that refine the earlier subsample.
+    Projections for mix_by and dimension are included when both are given.
+    """
+    filename = _normalize_filename(namefile)
+    media_type = _negotiate(request)
+
+    if filename not in datasets_cache:
+        raise HTTPException(status_code=404, detail=f"Dataset '{filename}' not found in cache.")
+
+    dataset = datasets_cache[filename]
+    dataset_sessions.touch(current_user.id, filename)
+    indices = dataset.subsample(n, start)
+
+    projections = {}
+    if mix_by and dimension:
+        mix_type, dim = mix_by.lower(), dimension.lower()
+        if mix_type not in dataset.projections or dim not in dataset.projections[mix_type]:
+            raise HTTPException(status_code=400, detail=f"No projections for '{mix_by}' / '{dimension}'")
+        stack = dataset.projections[mix_type][dim]
+        projections = {name: stack[name][indices] for name in (algorithms or stack) if name in stack}
+
+    meta = {"total": len(dataset.X), "start": start, "n": n, "status": _status(dataset)}
+    headers = {"Vary": "Accept"}
+    if media_type == wire_format.JSON:
+        return JSONResponse({
+            **meta,
+            "indices": indices.tolist(),
+            "X": dataset.X[indices].tolist(),
+            "y": [dataset.y[i] for i in indices],
+            "projections": {name: data.tolist() for name, data in projections.items()}
+        }, headers=headers)
+
+    meta["indices"] = indices.tolist()
+    arrays = {"X": dataset.X[indices]}
+    arrays.update({f"projections/{name}": data for name, data in projections.items()})
+    labels = (dataset.label_codes[indices], dataset.label_names)
+    content = await asyncio.to_thread(wire_format.encode, media_type, meta, arrays, labels)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+@router.get("/dataset/{namefile:path}")
+async def get_dataset(
+    request: Request,
+    namefile: str,
+    lazy: Optional[bool] = None,
+    keep_others: bool = False,
+    current_user=Depends(get_current_user)
+):
+    # Normalize and secure the filename
+    filename = _normalize_filename(namefile)
     file_path = os.path.join(DATASET_FOLDER, filename)
+    media_type = _negotiate(request)
 
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail=f"File '{filename}' not found")
 
-    # Cancel previous dataset processing if switching to a new one
-    if current_dataset_filename and current_dataset_filename != filename:
-        old_dataset = datasets_cache.get(current_dataset_filename)
-        if old_dataset:
-            old_dataset.cancel() # Set the cancel flag
-            print(f"Cancelling computation for {current_dataset_filename}")
-
-        if current_dataset_filename in dataset_tasks:
-            task = dataset_tasks.pop(current_dataset_filename)
-            # Await the cancellation to ensure the old task finishes its cleanup
-            # and doesn't interfere with the new one. Use suppress for robustness.
-            with contextlib.suppress(asyncio.CancelledError):
-                if not task.done(): # Only await if still running
-                    task.cancel()
-                    await task
-            print(f"Cleaned up task for {current_dataset_filename}")
-        
-        # Important: Remove the old dataset from cache only AFTER its task is handled
-        # This prevents a brief period where the old dataset might be accessed but its task is gone
-        if current_dataset_filename in datasets_cache:
-            del datasets_cache[current_dataset_filename]
-            print(f"Removed {current_dataset_filename} from cache")
-
-
     # Use cached dataset if available
     if filename in datasets_cache:
-        dataset = datasets_cache[filename]
-        current_dataset_filename = filename  # Ensure tracking is consistent
-
-        # If projections are ready, return them.
-        if dataset.ready:
-            return {
-                "X": dataset.X.tolist(),
-                "y": dataset.y,
-                "projections": dataset.projections, # Return actual projections here
-                "status": "ready"
-            }
-        else:
-            # If not ready, indicate processing status but don't return incomplete projections
-            return {
-                "X": dataset.X.tolist(),
-                "y": dataset.y,
-                "projections": {"status": "processing"} # No actual data here yet
-            }
+        dataset = datasets_cache[filename]  # also marks it most recently used
+        _hold(current_user.id, filename, keep_others)
+        # Projections keep landing while computing, so re-check the memory budget
+        datasets_cache.enforce_budget()
+
+        return await _respond(request, dataset, media_type)
 
     # Load and validate the CSV if not in cache
     try:
-        df = pd.read_csv(file_path)
+        with open(file_path, "rb") as f:
+            raw = f.read()
+        df = pd.read_csv(io.BytesIO(raw))
 
         required_columns = {"X", "Y", "Z", "Label"}
         if not required_columns.issubset(df.columns):
@@ -84,23 +401,43 @@ async def get_dataset(namefile: str, current_user=Depends(get_current_user)):
         X = df[["X", "Y", "Z"]].values.tolist()
         y = df["Label"].tolist()
 
-        dataset = Dataset(name=filename, X=X, y=y, defer_computation=True)
+        key = projection_store.cache_key(raw)
+        dataset = Dataset(name=filename, X=X, y=y, defer_computation=True, cache_key=key,
+                          lazy=LAZY_PROJECTIONS if lazy is None else lazy)
         datasets_cache[filename] = dataset
-        current_dataset_filename = filename
+        # Curves memoized for an earlier copy of this file no longer apply
+        quality_memo.invalidate(filename)
+        _hold(current_user.id, filename, keep_others)
+        # Quality curves only rank the embedding; the original data is ranked once, now,
+        # except for lazy datasets, where nothing heavy runs until a client asks for it
+        if not dataset.lazy:
+            dataset.prepare_quality_ranks()
+
+        # Reuse projections computed for identical content by an earlier run
+        stored = await asyncio.to_thread(projection_store.load, key)
+        if stored:
+            dataset.load_projections(*stored)
+            print(f"Loaded projections for {filename} from the projection store")
+            if dataset.ready:
+                return await _respond(request, dataset, media_type)
+            # Pairs missing from the store (cancelled, or from an older run) are fitted below
+
+        if dataset.lazy:
+            # Nothing runs until a projection is requested
+            return await _respond(request, dataset, media_type)
 
         # Start async task for projections
         task = asyncio.create_task(dataset.compute_projections())
         dataset_tasks[filename] = task
+        # The dataset has reached its full size once its projections are done
+        task.add_done_callback(lambda _: datasets_cache.enforce_budget())
 
         # Return initial status
-        return {
-            "X": dataset.X.tolist(),
-            "y": dataset.y,
-            "projections": {"status": "processing"} # Only status, no data yet
-        }
+        return await _respond(request, dataset, media_type)
 
     except Exception as e:
         # Clean up if an error occurs during initial loading
+        dataset_sessions.release(current_user.id, filename)
         if filename in datasets_cache:
             del datasets_cache[filename]
         if filename in dataset_tasks:
@@ -110,23 +447,3 @@ async def get_dataset(namefile: str, current_user=Depends(get_current_user)):
                     task.cancel()
                     await task
         raise HTTPException(status_code=500, detail=f"Error processing dataset: {str(e)}")
-
-# Add a new endpoint to specifically fetch projections when they are ready
-@router.get("/dataset/{namefile:path}/projections")
-async def get_dataset_projections(namefile: str, current_user=Depends(get_current_user)):
-    filename = os.path.basename(namefile)
-    if not filename.endswith(".csv"):
-        filename += ".csv"
-
-    if filename not in datasets_cache:
-        raise HTTPException(status_code=404, detail=f"Dataset '{filename}' not found in cache.")
-
-    dataset = datasets_cache[filename]
-
-    if not dataset.ready:
-        raise HTTPException(status_code=202, detail="Projections are still being computed.") # 202 Accepted, still processing
-
-    return {
-        "status": "ready",
-        "projections": dataset.projections
-    }
\ No newline at end of file
@@ -1,16 +1,37 @@
 # app/api/endpoints/quality.py
 from fastapi import APIRouter, HTTPException
-from app.schemas.quality import QualityCurveRequest, QualityCurveResponse
-from app.api.cache import datasets_cache
+from fastapi.responses import StreamingResponse
+from app.schemas.quality import (
+    QualityCurveRequest, QualityCurveResponse, QualityMetricsRequest, QualityMetricsResponse,
+    QualityBatchRequest, QualityBatchResponse, BlendOptimizationRequest
+)
+from app.api.cache import datasets_cache, quality_memo
 from app.services.algorithm_utils import normalize_algorithm_name
-from nxcurve import quality_curve
+from app.services.rank_quality import (
+    quality_curve, quality_metrics, run_quality, CURVE_BYTES_PER_PAIR, METRICS_BYTES_PER_PAIR
+)
+from app.services.blend_optimizer import BlendOptimization
+from app.services.event_bus import event_bus
 import numpy as np
 import asyncio
+import json
+import os
 
 router = APIRouter()
 
-@router.post("/quality-curve", response_model=QualityCurveResponse)
-async def compute_quality_curve(payload: QualityCurveRequest):
+# Upper bound on blends per batch request; each one holds an N x d float64 array
+QUALITY_BATCH_MAX = int(os.getenv("QUALITY_BATCH_MAX", 256))
+# Finished optimizations kept for polling before the oldest are forgotten
+OPTIMIZATION_HISTORY = int(os.getenv("OPTIMIZATION_HISTORY", 32))
+optimization_jobs = {}  # id -> BlendOptimization
+optimization_tasks = {}  # id -> asyncio task running it
+
+
+def resolve_request(payload):
+    """
+    Validates the dataset, dimension and mix type any quality or blend request
+    names; returns the dataset, mix type and dim key.
+    """
     dataset_key = payload.dataset_name + ".csv"
 
     if dataset_key not in datasets_cache:
@@ -18,10 +39,6 @@ async def compute_quality_curve(payload: QualityCurveRequest):
 
     dataset = datasets_cache[dataset_key]
 
-    if not dataset.ready:
-        raise HTTPException(status_code=400, detail="Dataset projections not ready yet")
-
-    X = dataset.X
     n_components = 2 if payload.target_dimension == "2D" else 3
     dim_key = "2d" if n_components == 2 else "3d"
     mix_type = payload.mix_by.lower()
@@ -29,28 +46,245 @@ async def compute_quality_curve(payload: QualityCurveRequest):
     if mix_type not in dataset.projections:
         raise HTTPException(status_code=400, detail=f"Mix type '{mix_type}' not found in projections")
 
-    total = sum(algo.percentage for algo in payload.algorithms)
+    return dataset, mix_type, dim_key
+
+
+def blend_weights(algorithms) -> dict:
+    """Weights as fractions per algorithm, repeated names added up; percentages must sum to 100."""
+    total = sum(algo.percentage for algo in algorithms)
     if total != 100:
         raise HTTPException(status_code=400, detail="Percentages must sum to 100")
 
-    blended = np.zeros((X.shape[0], n_components))
-    for algo in payload.algorithms:
-        try:
-            proj = dataset.projections[mix_type][dim_key][algo.name]
-        except KeyError:
-            raise HTTPException(status_code=400, detail=f"Projection '{algo.name}' not available")
-        blended += np.array(proj) * (algo.percentage / 100.0)
+    weights = {}
+    for algo in algorithms:
+        weights[algo.name] = weights.get(algo.name, 0.0) + algo.percentage / 100.0
+    return weights
+
+
+def _missing_projection(dataset, algo_name: str) -> HTTPException:
+    # Projections arrive one by one, so a missing one may still be computing
+    if not dataset.ready and not dataset.lazy:
+        return HTTPException(status_code=400, detail=f"Projection '{algo_name}' not ready yet")
+    return HTTPException(status_code=400, detail=f"Projection '{algo_name}' not available")
+
+
+async def projection_stack(dataset, mix_type: str, dim_key: str, algo_names):
+    """
+    The stack to blend algo_names from, once it holds all of them. Whatever the
+    client is waiting for gets computed next (or now, for lazy datasets); a
+    projection still missing after that is a 400.
+    """
+    await dataset.request_projections(mix_type, dim_key, list(algo_names))
+    stack = dataset.projections[mix_type][dim_key]
+    for algo_name in algo_names:
+        if algo_name not in stack:
+            raise _missing_projection(dataset, algo_name)
+    return stack
+
+
+async def _blend(dataset, payload: QualityCurveRequest, mix_type: str, dim_key: str):
+    weights = blend_weights(payload.algorithms)
+    stack = await projection_stack(dataset, mix_type, dim_key, weights)
+    return stack.blend(weights, payload.alignment)
+
+
+@router.get("/quality-curve/memo")
+async def get_quality_memo_stats():
+    """Hit/miss counts of the quality-curve memo."""
+    return quality_memo.stats()
+
+
+@router.post("/quality-curve", response_model=QualityCurveResponse)
+async def compute_quality_curve(payload: QualityCurveRequest):
+    dataset, mix_type, dim_key = resolve_request(payload)
+    blend_weights(payload.algorithms)  # a bad request is rejected before the memo lookup
+
+    memo_key = quality_memo.key(payload.dataset_name + ".csv", dataset.cache_key, dim_key, mix_type,
+                                [(algo.name, algo.percentage) for algo in payload.algorithms], payload.alignment)
+    cached = quality_memo.get(memo_key)
+    if cached is not None:
+        return cached
+
+    blended = await _blend(dataset, payload, mix_type, dim_key)
 
     try:
-        nx_values, auc, _ = await asyncio.to_thread(
-            quality_curve, X, blended, 20, "r", False
-        )
+        ranks = await dataset.quality_ranks()
+        nx_values, auc, _ = await run_quality(CURVE_BYTES_PER_PAIR, ranks.n_samples, quality_curve, ranks, blended, "r")
 
-        return QualityCurveResponse(
+        response = QualityCurveResponse(
             curve=nx_values.tolist(),
             auc=float(auc),
             k_neighbors=20,
             opt="r"
         )
+        quality_memo.put(memo_key, response)
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"RNX computation failed: {str(e)}")
+
+
+@router.post("/metrics", response_model=QualityMetricsResponse)
+async def compute_quality_metrics(payload: QualityMetricsRequest):
+    """
+    Trustworthiness, continuity, R_NX and normalized stress of a blend for each
+    requested k, plus the R_NX curve and its AUC, from one pair of rankings.
+    """
+    dataset, mix_type, dim_key = resolve_request(payload)
+    blended = await _blend(dataset, payload, mix_type, dim_key)
+
+    try:
+        ranks = await dataset.quality_ranks()
+        metrics = await run_quality(METRICS_BYTES_PER_PAIR, ranks.n_samples, quality_metrics,
+                                    ranks, dataset.X, blended, payload.k_values)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Metric computation failed: {str(e)}")
+
+    return QualityMetricsResponse(
+        k_values=metrics["k"],
+        trustworthiness=metrics["trustworthiness"],
+        continuity=metrics["continuity"],
+        rnx=metrics["rnx"],
+        curve=metrics["rnx_curve"],
+        auc=metrics["auc"],
+        stress=metrics["stress"]
+    )
+
+
+@router.post("/quality-curve/batch", response_model=QualityBatchResponse)
+async def compute_quality_curves(payload: QualityBatchRequest):
+    """
+    Quality curves for many blends of the same projections. All blends are built
+    in one contraction over the stacked projections and evaluated in parallel;
+    blends already in the memo are not recomputed.
+    """
+    dataset, mix_type, dim_key = resolve_request(payload)
+
+    if not payload.weights:
+        raise HTTPException(status_code=400, detail="At least one weight vector is required")
+    if len(payload.weights) > QUALITY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {QUALITY_BATCH_MAX} weight vectors per request")
+
+    weights = np.asarray(payload.weights, dtype=np.float64) if all(
+        len(row) == len(payload.algorithms) for row in payload.weights) else None
+    if weights is None:
+        raise HTTPException(status_code=400, detail="Each weight vector needs one percentage per algorithm")
+    # Generated weight vectors rarely sum to exactly 100 in floating point
+    if not np.allclose(weights.sum(axis=1), 100):
+        raise HTTPException(status_code=400, detail="Percentages must sum to 100")
+
+    try:
+        results = await _evaluate_blends(dataset, mix_type, dim_key, payload.algorithms, weights,
+                                         payload.alignment)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"RNX computation failed: {str(e)}")
+
+    return QualityBatchResponse(algorithms=payload.algorithms, results=results)
+
+
+async def _evaluate_blends(dataset, mix_type: str, dim_key: str, algorithms, weights,
+                           alignment: str = "none") -> list:
+    """
+    Quality curves for rows of percentages over the same algorithms. Memoized
+    blends are reused; the rest are blended in one contraction and evaluated
+    concurrently on the quality executor.
+    """
+    memo_keys = [
+        quality_memo.key(dataset.name, dataset.cache_key, dim_key, mix_type, zip(algorithms, row), alignment)
+        for row in weights.tolist()
+    ]
+    results = [quality_memo.get(key) for key in memo_keys]
+    todo = [i for i, result in enumerate(results) if result is None]
+    if not todo:
+        return results
+
+    stack = await projection_stack(dataset, mix_type, dim_key, algorithms)
+    ranks = await dataset.quality_ranks()
+    blends = stack.blend_many(list(algorithms), weights[todo] / 100.0, alignment)
+    # As many run at once as the quality memory budget allows for this N
+    curves = await asyncio.gather(*[
+        run_quality(CURVE_BYTES_PER_PAIR, ranks.n_samples, quality_curve, ranks, blend, "r") for blend in blends
+    ])
+
+    for i, (nx_values, auc, _) in zip(todo, curves):
+        results[i] = QualityCurveResponse(curve=nx_values.tolist(), auc=float(auc), k_neighbors=20, opt="r")
+        quality_memo.put(memo_keys[i], results[i])
+    return results
+
+
+def _notify_optimization(snapshot: dict):
+    event = {key: value for key, value in snapshot.items() if key != "history"}
+    # Progress of one search supersedes its earlier, still unsent progress
+    event_bus.publish("progress", {"type": "blend_optimization", **event}, key=f"blend_optimization:{event['id']}")
+
+
+def _forget_finished_optimizations():
+    finished = [job_id for job_id, job in optimization_jobs.items() if job.finished]
+    for job_id in finished[:max(0, len(finished) - OPTIMIZATION_HISTORY)]:
+        optimization_jobs.pop(job_id, None)
+        optimization_tasks.pop(job_id, None)
+
+
+def _get_optimization(job_id: str) -> BlendOptimization:
+    if job_id not in optimization_jobs:
+        raise HTTPException(status_code=404, detail=f"Optimization '{job_id}' not found")
+    return optimization_jobs[job_id]
+
+
+@router.post("/optimize")
+async def start_blend_optimization(payload: BlendOptimizationRequest):
+    """
+    Starts a search for the blend of the given algorithms with the highest R_NX
+    AUC. Returns right away; follow it with GET /optimize/{id}, its /stream, or
+    the blend_optimization WebSocket events.
+    """
+    dataset, mix_type, dim_key = resolve_request(payload)
+
+    if len(set(payload.algorithms)) != len(payload.algorithms) or len(payload.algorithms) < 2:
+        raise HTTPException(status_code=400, detail="At least two distinct algorithms are required")
+    if payload.max_evaluations < len(payload.algorithms) + 1 or not 0 < payload.min_step < 1:
+        raise HTTPException(status_code=400, detail="max_evaluations or min_step out of range")
+    # A projection that is missing fails the request now rather than the search later
+    await projection_stack(dataset, mix_type, dim_key, payload.algorithms)
+
+    async def evaluate(weights):
+        results = await _evaluate_blends(dataset, mix_type, dim_key, payload.algorithms, weights,
+                                         payload.alignment)
+        return [result.auc for result in results]
+
+    job = BlendOptimization(dataset.name, payload.target_dimension, mix_type, payload.algorithms, evaluate,
+                            max_evaluations=payload.max_evaluations, min_step=payload.min_step)
+    job.on_progress(_notify_optimization)
+    _forget_finished_optimizations()
+    optimization_jobs[job.id] = job
+    optimization_tasks[job.id] = asyncio.create_task(job.run())
+    return job.snapshot()
+
+
+@router.get("/optimize/{job_id}")
+async def get_blend_optimization(job_id: str):
+    return _get_optimization(job_id).snapshot()
+
+
+@router.get("/optimize/{job_id}/stream")
+async def stream_blend_optimization(job_id: str):
+    """Server-sent events: the best blend so far after every improvement, then the final result."""
+    job = _get_optimization(job_id)
+
+    async def events():
+        async for snapshot in job.updates():
+            yield f"data: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.delete("/optimize/{job_id}")
+async def cancel_blend_optimization(job_id: str):
+    job = _get_optimization(job_id)
+    task = optimization_tasks.get(job_id)
+    if task is not None and not task.done():
+        task.cancel()
+    return {"message": f"Optimization '{job_id}' cancelled.", "status": job.status}
@@ -1,47 +1,227 @@
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
 import json
 import asyncio
-import numpy as np
-from app.services.algorithm_utils import normalize_algorithm_name, compute_continuity
-from nxcurve import quality_curve
-from app.api.cache import datasets_cache
+import os
+import weakref
+from app.api.cache import quality_memo
+from app.services.session_store import dataset_sessions
+from app.schemas.quality import QualityCurveRequest, QualityCurveResponse
+from app.api.quality import resolve_request, blend_weights, projection_stack
+from app.services import wire_format
+from app.services.rank_quality import quality_curve, run_quality, CURVE_BYTES_PER_PAIR
+from concurrent.futures import ThreadPoolExecutor
+from app.services.websocket_hub import hub
+from app.services.event_bus import event_bus
+
+# Clients offering this subprotocol get results as raw float32 frames (wire_format's
+# RAW_FLOAT32 layout) instead of JSON, with labels sent once per dataset
+BINARY_SUBPROTOCOL = "drbackend.float32.v1"
+# Threads blending and encoding slider results; kept apart from the quality curves,
+# so a long batch of curves never holds up a slider
+BLEND_WORKERS = int(os.getenv("BLEND_WORKERS", 2))
+
+blend_executor = ThreadPoolExecutor(max_workers=BLEND_WORKERS, thread_name_prefix="blend")
+
+
+def select_subprotocol(websocket: WebSocket):
+    """The subprotocol to accept the connection with, or None for plain JSON."""
+    if BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return BINARY_SUBPROTOCOL
+    return None
+
+
+def dataset_topic(name: str) -> str:
+    """Topic of a dataset's events; clients may name it with or without the .csv suffix."""
+    return name if name.endswith(".csv") else name + ".csv"
 
-connected_clients = []
 
 # ✅ Robust thread-safe notification
+def safe_notify_clients(event: dict, key: str = None, channel: str = "projections"):
+    """
+    Publishes an event on the event bus, which brings it to the clients of every
+    worker; callable from any thread. key lets a newer event replace an unsent
+    older one with the same key.
+    """
+    event_bus.publish(channel, event, key)
+
+
+def deliver_event(channel: str, event: dict, key: str = None):
+    """
+    Event bus subscriber: sends an event to this worker's clients following its
+    dataset (or to all of them, if it has none). Serialized once, then only queued per client.
+    """
+    message = json.dumps(event)
+    print(f"📡 Sending: {message}")
+    topic = dataset_topic(event["dataset"]) if event.get("dataset") else None
+    hub.broadcast(message, topic, key)
+
+
 def safe_notify_clients_projection_ready(dataset_name: str):
-    from asyncio import run_coroutine_threadsafe
-
-    async def notify_clients():
-        message = json.dumps({
-            "type": "projections_ready",
-            "dataset": dataset_name
-        })
-        print(f"📡 Sending: {message}")
-        for client in connected_clients:
-            try:
-                await client.send_text(message)
-            except Exception as e:
-                print(f"❌ Error notifying client: {e}")
+    safe_notify_clients({
+        "type": "projections_ready",
+        "dataset": dataset_name
+    })
 
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = None
-
-    if loop and loop.is_running():
-        run_coroutine_threadsafe(notify_clients(), loop)
-    else:
-        # fallback for threads
-        new_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(new_loop)
-        new_loop.run_until_complete(notify_clients())
-        new_loop.close()
+
+def safe_notify_clients_projection_added(dataset_name: str, mix_type: str, dim: str, algo_name: str):
+    safe_notify_clients({
+        "type": "projection_added",
+        "dataset": dataset_name,
+        "mix_type": mix_type,
+        "dimension": dim,
+        "algorithm": algo_name
+    })
 
 # ⛓️ Your main WebSocket consumer
+def _labels_frame(dataset) -> bytes:
+    return wire_format.encode(wire_format.RAW_FLOAT32, {"type": "labels", "dataset": dataset.name}, {},
+                              labels=(dataset.label_codes, dataset.label_names))
+
+
+def _result_frame(dataset, stack, weights, alignment: str, binary: bool, request_id=None):
+    """Blends and encodes one result; runs on a worker thread, never on the event loop."""
+    blended = stack.blend(weights, alignment)
+    if binary:
+        return wire_format.encode(wire_format.RAW_FLOAT32,
+                                  {"type": "result", "dataset": dataset.name, "request_id": request_id},
+                                  {"output": blended})
+    return json.dumps({
+        "type": "result",
+        "request_id": request_id,
+        "output": blended.tolist(),
+        "y": dataset.y
+    })
+
+
+def _quality_curve(ranks, stack, weights, alignment: str) -> QualityCurveResponse:
+    curve, auc, _ = quality_curve(ranks, stack.blend(weights, alignment), "r")
+    return QualityCurveResponse(curve=curve.tolist(), auc=float(auc), k_neighbors=20, opt="r")
+
+
+class QualityRequestError(Exception):
+    """A request the client has to fix; reported on the socket, which stays open."""
+
+
+class QualityConnection:
+    """
+    One /ws/quality client. Each request runs as its own task, and a newer
+    request of the same type supersedes the older one, pending or running,
+    so a dragged slider only ever costs the position it stopped at.
+    Blends ("type" absent or "blend") and quality curves ("quality_curve")
+    are tracked separately, so a blend doesn't cancel the curve of the same weights.
+
+    Replies go through the client's hub queue like every notification, keyed
+    so that an unsent older result is replaced by the newer one.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.client = hub.register(websocket)
+        self.binary = select_subprotocol(websocket) == BINARY_SUBPROTOCOL
+        self.labels_sent = weakref.WeakSet()  # datasets whose labels this client already has
+        self.tasks = {}  # request type -> latest task
+        self.superseded = 0
+        datasets = websocket.query_params.get("datasets")
+        if datasets:
+            hub.subscribe(websocket, [dataset_topic(name) for name in datasets.split(",") if name])
+
+    def submit(self, payload: dict):
+        kind = payload.get("type") or "blend"
+        if kind in ("subscribe", "unsubscribe"):
+            # Dataset events go only to subscribers; a client that never subscribes gets all of them
+            topics = [dataset_topic(name) for name in payload.get("datasets", [])]
+            (hub.subscribe if kind == "subscribe" else hub.unsubscribe)(self.websocket, topics)
+            self.send_json({"type": "subscriptions", "datasets": sorted(self.client.topics)}, key="subscriptions")
+            return
+        handler = {"blend": self._blend, "quality_curve": self._quality_curve}.get(kind)
+        if handler is None:
+            self.send_json({"error": f"Unknown request type '{kind}'", "request_id": payload.get("request_id")})
+            return
+        previous = self.tasks.get(kind)
+        if previous is not None and not previous.done():
+            # Cancels the await; a blend or curve not yet started on the executor is dropped from its queue
+            previous.cancel()
+            self.superseded += 1
+        self.tasks[kind] = asyncio.ensure_future(self._run(handler, payload))
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+    async def _run(self, handler, payload: dict):
+        request_id = payload.get("request_id")
+        try:
+            await handler(payload, request_id)
+        except asyncio.CancelledError:
+            raise
+        except QualityRequestError as e:
+            self.send_json({"error": str(e), "request_id": request_id})
+        except HTTPException as e:
+            # Validated like the HTTP endpoints, reported on the socket
+            self.send_json({"error": e.detail, "request_id": request_id})
+        except Exception as e:
+            print("⚠️ Quality request failed:", e)
+            self.send_json({"error": str(e), "request_id": request_id})
+
+    def _resolve(self, payload: dict):
+        """
+        Validates a blend request like the HTTP endpoints do; returns the request,
+        dataset, mix type, dim key and weights as fractions.
+        """
+        try:
+            request = QualityCurveRequest.model_validate(payload)
+        except ValidationError as e:
+            error = e.errors()[0]
+            raise QualityRequestError(f"Invalid '{'.'.join(map(str, error['loc']))}': {error['msg']}")
+        print(f"📦 Dataset: {request.dataset_name}.csv")
+        dataset, mix_type, dim_key = resolve_request(request)
+
+        user = getattr(self.websocket.state, "user", None)
+        if user is not None:
+            # Slider traffic counts as using the dataset, so its hold doesn't lapse mid-session
+            dataset_sessions.touch(user.id, dataset.name)
+        return request, dataset, mix_type, dim_key, blend_weights(request.algorithms)
+
+    async def _blend(self, payload: dict, request_id):
+        request, dataset, mix_type, dim_key, weights = self._resolve(payload)
+        stack = await projection_stack(dataset, mix_type, dim_key, weights)
+
+        # One contraction over the stacked projections (repeated settings come from its
+        # cache), then serialization, both off the loop so other connections keep flowing
+        loop = asyncio.get_running_loop()
+        frame = await loop.run_in_executor(blend_executor, _result_frame, dataset, stack, weights,
+                                           request.alignment, self.binary, request_id)
+        print("✅ Blended projection computed.")
+
+        if self.binary and dataset not in self.labels_sent:
+            labels = await loop.run_in_executor(blend_executor, _labels_frame, dataset)
+            self.client.offer(labels, key=f"labels:{dataset.name}")
+            self.labels_sent.add(dataset)
+        self.client.offer(frame, key="result")
+
+    async def _quality_curve(self, payload: dict, request_id):
+        request, dataset, mix_type, dim_key, weights = self._resolve(payload)
+        memo_key = quality_memo.key(dataset.name, dataset.cache_key, dim_key, mix_type,
+                                    [(algo.name, algo.percentage) for algo in request.algorithms],
+                                    request.alignment)
+        result = quality_memo.get(memo_key)
+        if result is None:
+            stack = await projection_stack(dataset, mix_type, dim_key, weights)
+            ranks = await dataset.quality_ranks()
+            result = await run_quality(CURVE_BYTES_PER_PAIR, ranks.n_samples, _quality_curve, ranks, stack,
+                                       weights, request.alignment)
+            quality_memo.put(memo_key, result)
+        self.send_json({"type": "quality_curve", "request_id": request_id, **dict(result)}, key="quality_curve")
+
+    def send_json(self, message: dict, key: str = None):
+        self.client.offer(json.dumps(message), key)
+
+
 async def quality_ws(websocket: WebSocket):
+    await event_bus.start(deliver_event)  # normally already started with the app
+    connection = QualityConnection(websocket)
     try:
-        connected_clients.append(websocket)
         while True:
             try:
                 data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
@@ -51,65 +231,21 @@ async def quality_ws(websocket: WebSocket):
                     print("🔄 Pong received.")
                     continue
 
-                dataset_name = payload.get("dataset_name") + ".csv"
-                print(f"📦 Dataset: {dataset_name}")
-
-                if dataset_name not in datasets_cache:
-                    await websocket.send_text(json.dumps({"error": f"Dataset '{dataset_name}' not found"}))
-                    return
-
-                dataset = datasets_cache[dataset_name]
-                if not dataset.ready:
-                    await websocket.send_text(json.dumps({"error": "Dataset projections not ready yet"}))
-                    return
-
-                X = dataset.X
-                y = dataset.y
-
-                n_components = 2 if payload["target_dimension"] == "2D" else 3
-                dim_key = "2d" if n_components == 2 else "3d"
-                mix_type = payload.get("mix_by").lower()
-
-                if mix_type not in dataset.projections:
-                    await websocket.send_text(json.dumps({"error": f"Mix type '{mix_type}' not found in projections"}))
-                    return
-
-                total_percentage = sum(algo["percentage"] for algo in payload["algorithms"])
-                if total_percentage != 100:
-                    await websocket.send_text(json.dumps({"error": "Percentages must sum to 100"}))
-                    return
-
-                blended = np.zeros((X.shape[0], n_components))
-                for algo in payload["algorithms"]:
-                    name = normalize_algorithm_name(algo["name"])
-                    weight = algo["percentage"] / 100.0
-                    try:
-                        projection = dataset.projections[mix_type][dim_key][algo["name"]]
-                    except KeyError:
-                        await websocket.send_text(json.dumps({"error": f"Projection '{algo['name']}' not available"}))
-                        return
-                    blended += np.array(projection) * weight
-
-                print("✅ Blended projection computed.")
-
-                await websocket.send_text(json.dumps({
-                    "type": "result",
-                    "output": blended.tolist(),
-                    "y": y
-                }))
+                connection.submit(payload)
 
             except asyncio.TimeoutError:
-                await websocket.send_text(json.dumps({"type": "keepalive"}))
+                connection.send_json({"type": "keepalive"}, key="keepalive")
 
     except WebSocketDisconnect:
-        if websocket in connected_clients:
-            connected_clients.remove(websocket)
         print("❌ Client disconnected")
     except Exception as e:
         print("⚠️ WebSocket error:", e)
+        hub.unregister(websocket)  # stops its writer, so this is the only send in flight
         try:
             await websocket.send_text(json.dumps({"error": str(e)}))
         except:
             pass
     finally:
+        connection.close()
+        hub.unregister(websocket)
         print("🔒 WebSocket connection closed.")
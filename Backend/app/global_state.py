@@ -1,7 +0,0 @@
-# app/global_state.py
-
-current_dataset = {
-    "X": None,
-    "y": None,
-    "name": None
-}
@@ -3,7 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.api import auth, dataset, data, quality,delete,upload,listfiles,deletefile,deleteaccout,theme,chat
 from app.database import engine
 from app.models import models
-from app.api.websocket import quality_ws
+from app.api.websocket import quality_ws, select_subprotocol, deliver_event
+from app.services.event_bus import event_bus
+from app.services.projection_engine import projection_engine
 from app.services.auth_utils import get_current_user_ws
 
 from fastapi.staticfiles import StaticFiles
@@ -54,6 +56,29 @@ app.include_router(deleteaccout.router)
 app.include_router(theme.router)
 app.include_router(chat.router)
 
+# Job processes fork from a server that has already compiled UMAP; it warms up in the background
+@app.on_event("startup")
+def start_projection_engine():
+    projection_engine.start()
+
+
+# Events from every worker (projections, progress, forum) reach this worker's sockets through the bus
+@app.on_event("startup")
+async def start_event_bus():
+    await event_bus.start(deliver_event)
+
+
+@app.on_event("shutdown")
+async def stop_event_bus():
+    await event_bus.stop()
+
+
+# Kills running job processes and stops the supervisors instead of leaving them to interpreter exit
+@app.on_event("shutdown")
+def stop_projection_engine():
+    projection_engine.shutdown()
+
+
 # WebSocket route
 @app.websocket("/ws/quality")
 async def websocket_quality(websocket: WebSocket):
@@ -72,8 +97,8 @@ async def websocket_quality(websocket: WebSocket):
     # Attach user if needed
     websocket.state.user = user
 
-    # Accept connection only after validation
-    await websocket.accept()
+    # Accept connection only after validation, in binary mode if the client asked for it
+    await websocket.accept(subprotocol=select_subprotocol(websocket))
 
     # Delegate to quality handler
     await quality_ws(websocket)
@@ -10,6 +10,8 @@ class QualityCurveRequest(BaseModel):
     target_dimension: Literal["2D", "3D"]
     mix_by: str
     algorithms: List[AlgorithmWeight]
+    # "procrustes" aligns and scale-normalizes the projections before blending
+    alignment: Literal["none", "procrustes"] = "none"
 
 class QualityCurveResponse(BaseModel):
     type: str = "quality_curve"
@@ -17,3 +19,39 @@ class QualityCurveResponse(BaseModel):
     auc: float
     k_neighbors: int
     opt: str
+
+class QualityMetricsRequest(QualityCurveRequest):
+    k_values: List[int] = [5, 10, 20]
+
+class QualityMetricsResponse(BaseModel):
+    type: str = "quality_metrics"
+    k_values: List[int]
+    trustworthiness: List[float]
+    continuity: List[float]
+    rnx: List[float]
+    curve: List[float]
+    auc: float
+    stress: float
+
+class QualityBatchRequest(BaseModel):
+    dataset_name: str
+    target_dimension: Literal["2D", "3D"]
+    mix_by: str
+    algorithms: List[str]
+    # One row of percentages per blend, aligned with algorithms
+    weights: List[List[float]]
+    alignment: Literal["none", "procrustes"] = "none"
+
+class QualityBatchResponse(BaseModel):
+    type: str = "quality_batch"
+    algorithms: List[str]
+    results: List[QualityCurveResponse]
+
+class BlendOptimizationRequest(BaseModel):
+    dataset_name: str
+    target_dimension: Literal["2D", "3D"]
+    mix_by: str
+    algorithms: List[str]
+    max_evaluations: int = 200
+    min_step: float = 0.01
+    alignment: Literal["none", "procrustes"] = "none"
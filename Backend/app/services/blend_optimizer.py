@@ -0,0 +1,152 @@
+# app/services/blend_optimizer.py
+
+from typing import Awaitable, Callable, List
+import asyncio
+import time
+import uuid
+import numpy as np
+
+# Smallest share of the blend moved between two algorithms before the search stops
+OPTIMIZER_MIN_STEP = 0.01
+
+
+class BlendOptimization:
+    """
+    Searches the weight simplex for the blend with the highest R_NX AUC by
+    coordinate ascent: from the best of the uniform blend and the pure
+    algorithms, it tries moving a share of the weight between every pair of
+    algorithms, keeps the best improvement, and halves the share when none helps.
+
+    evaluate(weights) takes rows of percentages and returns one AUC per row.
+    Every round is evaluated as one batch; progress is published after each.
+    """
+
+    def __init__(self, dataset_name: str, dim: str, mix_type: str, algorithms: List[str],
+                 evaluate: Callable[[np.ndarray], Awaitable[List[float]]],
+                 max_evaluations: int = 200, min_step: float = OPTIMIZER_MIN_STEP):
+        self.id = uuid.uuid4().hex
+        self.dataset_name = dataset_name
+        self.dim = dim
+        self.mix_type = mix_type
+        self.algorithms = list(algorithms)
+        self.max_evaluations = max_evaluations
+        self.min_step = min_step
+        self.status = "pending"
+        self.error = None
+        self.evaluations = 0
+        self.best_weights = None  # fractions, same order as algorithms
+        self.best_auc = None
+        self.history = []  # one entry per improvement
+        self.started_at = time.time()
+        self.finished_at = None
+        self._evaluate = evaluate
+        self._changed = asyncio.Event()
+        self._listeners: List[Callable] = []
+
+    def on_progress(self, callback: Callable) -> None:
+        """Registers callback(snapshot), run after each improvement and at the end."""
+        self._listeners.append(callback)
+
+    async def run(self):
+        self.status = "running"
+        try:
+            n_algorithms = len(self.algorithms)
+            start = np.vstack([np.full(n_algorithms, 1 / n_algorithms), np.eye(n_algorithms)])
+            aucs = await self._score(start)
+            best = int(np.argmax(aucs))
+            self._improve(start[best], aucs[best], step=None)
+
+            step = 0.5
+            while step >= self.min_step and self.evaluations < self.max_evaluations:
+                moves = self._moves(step)[:self.max_evaluations - self.evaluations]
+                if not len(moves):
+                    break
+                aucs = await self._score(moves)
+                best = int(np.argmax(aucs))
+                if aucs[best] > self.best_auc + 1e-12:
+                    self._improve(moves[best], aucs[best], step)
+                else:
+                    step /= 2
+            self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "error"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+            self._publish()
+
+    def _moves(self, step: float) -> np.ndarray:
+        """Every transfer of up to step from one algorithm to another, from the current best."""
+        moves = []
+        for to in range(len(self.algorithms)):
+            for source in range(len(self.algorithms)):
+                if to == source or self.best_weights[source] <= 0:
+                    continue
+                weights = self.best_weights.copy()
+                share = min(step, weights[source])
+                weights[source] -= share
+                weights[to] += share
+                moves.append(weights)
+        if not moves:
+            return np.empty((0, len(self.algorithms)))
+        return np.unique(np.round(np.array(moves), 6), axis=0)
+
+    async def _score(self, weights: np.ndarray) -> np.ndarray:
+        self.evaluations += len(weights)
+        return np.asarray(await self._evaluate(weights * 100), dtype=np.float64)
+
+    def _improve(self, weights, auc: float, step):
+        self.best_weights = np.asarray(weights, dtype=np.float64)
+        self.best_auc = float(auc)
+        self.history.append({
+            "evaluations": self.evaluations,
+            "step": step,
+            "auc": self.best_auc,
+            "weights": self._percentages(),
+        })
+        self._publish()
+
+    def _percentages(self):
+        if self.best_weights is None:
+            return None
+        return [{"name": name, "percentage": round(float(w) * 100, 4)}
+                for name, w in zip(self.algorithms, self.best_weights)]
+
+    def _publish(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+        snapshot = self.snapshot()
+        for callback in self._listeners:
+            callback(snapshot)
+
+    def snapshot(self) -> dict:
+        return {
+            "id": self.id,
+            "dataset": self.dataset_name,
+            "target_dimension": self.dim,
+            "mix_by": self.mix_type,
+            "status": self.status,
+            "error": self.error,
+            "evaluations": self.evaluations,
+            "max_evaluations": self.max_evaluations,
+            "best_auc": self.best_auc,
+            "best_weights": self._percentages(),
+            "history": list(self.history),
+            "elapsed": (self.finished_at or time.time()) - self.started_at,
+        }
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error", "cancelled")
+
+    async def updates(self):
+        """Yields a snapshot now and after every change, until the search finishes."""
+        while True:
+            changed = self._changed
+            yield self.snapshot()
+            if self.finished:
+                return
+            await changed.wait()
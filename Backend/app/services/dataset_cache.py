@@ -0,0 +1,133 @@
+# app/services/dataset_cache.py
+
+from collections import OrderedDict
+from typing import Callable, List
+import os
+import time
+
+# Total size of resident datasets (X plus projections) before LRU eviction kicks in
+DATASET_CACHE_BUDGET_MB = int(os.getenv("DATASET_CACHE_BUDGET_MB", 1024))
+
+
+class DatasetCache:
+    """
+    Dict-like store of loaded datasets, kept in least-recently-used order.
+    When the byte size of all entries exceeds the budget, the least recently
+    used unpinned datasets are cancelled and dropped.
+    """
+
+    def __init__(self, budget_bytes: int = DATASET_CACHE_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # name -> Dataset, oldest first
+        self._pinned = set()
+        self._last_access = {}
+        self._evict_callbacks: List[Callable] = []
+        self._keep_checks: List[Callable] = []
+
+    def __contains__(self, name) -> bool:
+        return name in self._entries
+
+    def __getitem__(self, name):
+        dataset = self._entries[name]
+        self.touch(name)
+        return dataset
+
+    def peek(self, name, default=None):
+        """Like get(), without counting as a use."""
+        return self._entries.get(name, default)
+
+    def get(self, name, default=None):
+        if name not in self._entries:
+            return default
+        return self[name]
+
+    def __setitem__(self, name, dataset):
+        self._entries[name] = dataset
+        self.touch(name)
+        self.enforce_budget()
+
+    def __delitem__(self, name):
+        del self._entries[name]
+        self._pinned.discard(name)
+        self._last_access.pop(name, None)
+
+    def pop(self, name, *default):
+        if name not in self._entries and default:
+            return default[0]
+        dataset = self._entries[name]
+        del self[name]
+        return dataset
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def keys(self):
+        return list(self._entries)
+
+    def touch(self, name):
+        """Marks a dataset as most recently used."""
+        self._entries.move_to_end(name)
+        self._last_access[name] = time.time()
+
+    def on_evict(self, callback: Callable) -> None:
+        """Registers callback(name, dataset), run after a dataset is evicted."""
+        self._evict_callbacks.append(callback)
+
+    def keep_if(self, check: Callable) -> None:
+        """Registers check(name); datasets for which any check is true are never evicted."""
+        self._keep_checks.append(check)
+
+    def _kept(self, name) -> bool:
+        return name in self._pinned or any(check(name) for check in self._keep_checks)
+
+    def pin(self, name) -> None:
+        if name not in self._entries:
+            raise KeyError(name)
+        self._pinned.add(name)
+
+    def unpin(self, name) -> None:
+        self._pinned.discard(name)
+
+    def total_bytes(self) -> int:
+        return sum(dataset.nbytes() for dataset in self._entries.values())
+
+    def enforce_budget(self) -> List[str]:
+        """
+        Evicts least recently used datasets that are neither pinned nor kept by a
+        keep_if check until the cache fits its budget. The most recently used one
+        is always kept. Returns evicted names.
+        """
+        evicted = []
+        sizes = {name: dataset.nbytes() for name, dataset in self._entries.items()}
+        total = sum(sizes.values())
+        candidates = [name for name in list(self._entries)[:-1] if not self._kept(name)]
+        for name in candidates:
+            if total <= self.budget_bytes:
+                break
+            dataset = self._entries[name]
+            del self[name]
+            dataset.cancel()
+            total -= sizes[name]
+            evicted.append(name)
+            print(f"Evicted {name} from the dataset cache ({sizes[name]} bytes)")
+            for callback in self._evict_callbacks:
+                callback(name, dataset)
+        return evicted
+
+    def entries(self) -> List[dict]:
+        """Resident datasets, most recently used first, with their sizes."""
+        return [
+            {
+                "name": name,
+                "bytes": dataset.nbytes(),
+                "memory": dataset.memory_usage(),
+                "pinned": name in self._pinned,
+                "kept": self._kept(name),
+                "ready": dataset.ready,
+                "last_access": self._last_access.get(name),
+            }
+            for name, dataset in reversed(self._entries.items())
+        ]
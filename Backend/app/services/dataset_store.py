@@ -1,58 +1,345 @@
 # app/services/dataset_store.py
 
 from typing import List, Dict
-from sklearn.decomposition import PCA, TruncatedSVD, FastICA, FactorAnalysis, NMF, KernelPCA
-from sklearn.manifold import TSNE, Isomap, LocallyLinearEmbedding, SpectralEmbedding
-from sklearn.random_projection import GaussianRandomProjection
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
 from sklearn.preprocessing import StandardScaler
+from sklearn.neighbors import NearestNeighbors
 import numpy as np
+import hashlib
+import json
+import sys
 import warnings
 import asyncio
-from app.api.websocket import safe_notify_clients_projection_ready
+from app.api.websocket import safe_notify_clients_projection_ready, safe_notify_clients_projection_added
+from app.services import projection_store
+from app.services.projection_stack import ProjectionStack
+from app.services.wire_format import encode_labels
+from app.services.rank_quality import HighDimRanks, QUALITY_RANKS_MAX_POINTS
+from app.services.projection_engine import (
+    projection_engine, projection_jobs, JobCancelled, ALGORITHMS, DIMENSIONS, max_neighbors, neighbors_needed,
+    LANDMARK_THRESHOLD, LANDMARK_COUNT, uses_landmarks, landmark_method, stratified_landmarks,
+    stratified_order
+)
 
 warnings.filterwarnings("ignore")
 
 
 class Dataset:
-    def __init__(self, name: str, X: List[List[float]], y: List[str], defer_computation: bool = False):
+    def __init__(self, name: str, X: List[List[float]], y: List[str], defer_computation: bool = False,
+                 cache_key: str = None, lazy: bool = False):
         self.name = name
+        # Lazy datasets compute nothing up front; each projection is fitted on first
+        # request. They only ever hold a subset, so they are not written to the store.
+        self.lazy = lazy
+        self.cache_key = cache_key  # key in the on-disk projection store, if any
         self.X = np.array(X)
         self.y = y
+        # Integer label codes for binary responses: y == label_names[label_codes]
+        self.label_codes, self.label_names = encode_labels(y)
+        # One float32 tensor per mix type and dimension, filled as fits finish
         self.projections = {
+            mix_type: {
+                dim: ProjectionStack([name for mix, name in ALGORITHMS if mix == mix_type],
+                                     len(self.X), n_components)
+                for dim, n_components in DIMENSIONS.items()
+            }
+            for mix_type in ("kernel", "reduced")
+        }
+        # Per-job status, mirrors the layout of self.projections
+        self.jobs = {
             "kernel": {"2d": {}, "3d": {}},
             "reduced": {"2d": {}, "3d": {}}
         }
+        # Projections fitted on landmarks only, with how the other rows were placed
+        self.approximate = {
+            "kernel": {"2d": {}, "3d": {}},
+            "reduced": {"2d": {}, "3d": {}}
+        }
+        # Row indices the quadratic methods are fitted on, for large datasets only
+        self.landmarks = None
+        if len(self.X) > LANDMARK_THRESHOLD:
+            self.landmarks = stratified_landmarks(self.y, LANDMARK_COUNT)
+        self._quality_ranks_task = None  # HD neighbour order for quality curves
+        self._lod_order = None  # label-stratified row order for subsampling, built on first use
+        self._labels_nbytes = sys.getsizeof(y) + sum(sys.getsizeof(label) for label in y)
         self.ready = False
         self._cancel_flag = False
+        self._submitted = []  # every ProjectionJob of this dataset
+        self._pool_jobs = {}  # (mix_type, dim, algo_name) -> ProjectionJob
+        self._wanted = set()  # requested before their jobs were queued
+        self._prepare_task = None
+        self._lazy_runs = {}  # (mix_type, dim, algo_name) -> shared lazy computation
 
-        if not defer_computation:
+        if not defer_computation and not lazy:
             asyncio.create_task(self.compute_projections())  # async launch if not deferred
 
     def cancel(self):
         print('cancell ', self.name)
         self._cancel_flag = True
         self.ready = False
+        # Queued jobs are dropped and running ones have their process killed,
+        # which frees the CPU and memory right away
+        for pool_job in self._submitted:
+            projection_engine.cancel(pool_job)
 
     async def compute_projections(self):
         if self._cancel_flag:
             return
         try:
-            await asyncio.to_thread(self._compute_all_projections)
+            X_scaled = await self._scaled()
+        except Exception as e:
+            print(f"Computation stopped: {e}")
+            return
+        if self._cancel_flag:
+            return  # cancelled while preparing
+
+        # Pairs loaded from the projection store are not fitted again
+        missing = self._missing_jobs()
+        try:
+            # One neighbour search sized for the most demanding consumer. Only the
+            # jobs hold it, so it is freed as soon as the last of them finishes.
+            neighbors = await asyncio.to_thread(self._neighbors, X_scaled, max_neighbors(len(self.X))) \
+                if missing else None
         except Exception as e:
             print(f"Computation stopped: {e}")
             return
+        runners = [self._submit(*spec, X_scaled, neighbors) for spec in missing]
+
+        try:
+            await asyncio.gather(*runners)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
 
         if not self._cancel_flag:
             self.ready = True
             print(self.ready, self.name)
             safe_notify_clients_projection_ready(self.name)
+            # Failed pairs are stored with their error, so later loads don't fit them again
+            if self.cache_key and runners:
+                try:
+                    await asyncio.to_thread(projection_store.save, self.cache_key, self.projections,
+                                            self.errors())
+                except Exception as e:
+                    print(f"Could not store projections for {self.name}: {e}")
+
+    def load_projections(self, projections: Dict, errors: Dict = None):
+        """
+        Fills the dataset from previously stored projections and the errors of the
+        pairs that failed back then. It is ready if together they cover every pair;
+        otherwise compute_projections fits the missing ones.
+        """
+        for mix_type, dims in projections.items():
+            for dim, algos in dims.items():
+                for algo_name, data in algos.items():
+                    self._add_projection(mix_type, dim, algo_name, data)
+                    self.jobs[mix_type][dim][algo_name] = {"status": "cached"}
+        for mix_type, dims in (errors or {}).items():
+            for dim, algos in dims.items():
+                for algo_name, error in algos.items():
+                    self.jobs[mix_type][dim][algo_name] = {"status": "error", "error": error}
+        self.ready = not self._missing_jobs()
+
+    def errors(self) -> Dict:
+        """Error of every pair whose fit failed, nested like self.projections."""
+        errors = {}
+        for mix_type, dims in self.jobs.items():
+            for dim, algos in dims.items():
+                for algo_name, job in algos.items():
+                    if job["status"] == "error" and algo_name not in self.projections[mix_type][dim]:
+                        errors.setdefault(mix_type, {}).setdefault(dim, {})[algo_name] = job.get("error", "")
+        return errors
+
+    def _missing_jobs(self) -> List:
+        """projection_jobs() specs with at least one dim that has neither a projection nor an error yet."""
+        return [spec for spec in projection_jobs()
+                if any(spec[1] not in self.projections[spec[0]][dim]
+                       and self.jobs[spec[0]][dim].get(spec[1], {}).get("status") != "error"
+                       for dim in spec[3])]
+
+    async def request_projections(self, mix_type: str, dim: str, algo_names: List[str]):
+        """
+        Called when a client references projections: lazy datasets compute
+        the missing ones, eager ones move them to the front of the queue.
+        """
+        if self.lazy:
+            await self.ensure_projections(mix_type, dim, algo_names)
+        else:
+            self.prioritize(mix_type, dim, algo_names)
+
+    async def ensure_projections(self, mix_type: str, dim: str, algo_names: List[str]):
+        """Computes the missing projections once; concurrent callers share the same fit."""
+        if self._cancel_flag or mix_type not in self.projections or dim not in DIMENSIONS:
+            return
+        runs = []
+        for algo_name in algo_names:
+            key = (mix_type, dim, algo_name)
+            if algo_name in self.projections[mix_type][dim]:
+                continue
+            if key not in self._lazy_runs:
+                spec = next((job for job in projection_jobs()
+                             if job[0] == mix_type and job[1] == algo_name and dim in job[3]), None)
+                if spec is None:
+                    continue  # unknown algorithm, reported as not available by the caller
+                run = asyncio.ensure_future(self._run_lazy(*spec))
+                for covered in spec[3]:
+                    self._lazy_runs[(mix_type, covered, algo_name)] = run
+            # Shielded so one caller going away doesn't cancel the others' computation
+            runs.append(asyncio.shield(self._lazy_runs[key]))
+        await asyncio.gather(*runs)
+
+    async def _run_lazy(self, mix_type: str, algo_name: str, n_components: int, dims: List[str]):
+        X_scaled = await self._scaled()
+        if self._cancel_flag:
+            return
+        # Only as many neighbours as this algorithm reads, and none for the linear ones
+        k = neighbors_needed(algo_name, len(self.X))
+        neighbors = await asyncio.to_thread(self._neighbors, X_scaled, k) if k else None
+        runner = self._submit(mix_type, algo_name, n_components, dims, X_scaled, neighbors)
+        # Someone is waiting on it, so it goes ahead of any eager work
+        projection_engine.promote(self._pool_jobs[(mix_type, dims[0], algo_name)])
+        await runner
+
+    def _submit(self, mix_type: str, algo_name: str, n_components: int, dims: List[str], X_scaled,
+                neighbors=None):
+        """
+        Queues one fit on the engine and returns the coroutine that collects it.
+        neighbors is a kNN graph at least as wide as the algorithm needs, or None.
+        """
+        landmarks = self.landmarks if uses_landmarks(algo_name, len(self.X)) else None
+        k = neighbors_needed(algo_name, len(self.X))
+        pool_job = projection_engine.submit(algo_name, n_components, X_scaled, self.y,
+                                            (neighbors[0][:, :k], neighbors[1][:, :k]) if k and neighbors else None,
+                                            landmarks)
+        self._submitted.append(pool_job)
+        job = {"status": "pending"}
+        for dim in dims:
+            self.jobs[mix_type][dim][algo_name] = job  # one fit serves every dim
+            self._pool_jobs[(mix_type, dim, algo_name)] = pool_job
+            if (mix_type, dim, algo_name) in self._wanted:
+                projection_engine.promote(pool_job)
+        return self._collect(mix_type, dims, algo_name, pool_job.future)
+
+    async def _scaled(self):
+        """Scaled data, prepared once for every caller."""
+        if self._prepare_task is None:
+            self._prepare_task = asyncio.ensure_future(asyncio.to_thread(self._prepare))
+        return await asyncio.shield(self._prepare_task)
+
+    def prioritize(self, mix_type: str, dim: str, algo_names: List[str]):
+        """Moves the jobs a client is asking for to the front of the queue."""
+        for algo_name in algo_names:
+            pool_job = self._pool_jobs.get((mix_type, dim, algo_name))
+            if pool_job is not None:
+                projection_engine.promote(pool_job)
+            else:
+                self._wanted.add((mix_type, dim, algo_name))
+
+    async def _collect(self, mix_type: str, dims: List[str], algo_name: str, future):
+        """
+        Waits for one engine job and stores its projection as soon as it finishes.
+        A job fitted for several dims stores the leading columns for each of them.
+        """
+        job = self.jobs[mix_type][dims[0]][algo_name]
+        try:
+            data = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            job["status"] = "cancelled"
+            return
+        except JobCancelled:
+            job["status"] = "cancelled"
+            return
+        except Exception as e:
+            print(f"{algo_name} ({', '.join(dims)}) failed for {self.name}: {e}")
+            job["status"] = "error"
+            job["error"] = str(e)
+            return
+
+        if self._cancel_flag:
+            job["status"] = "cancelled"
+            return
+        data = np.asarray(data)
+        for dim in dims:
+            n_components = DIMENSIONS[dim]
+            if data.ndim == 2 and data.shape[1] >= n_components:
+                self._add_projection(mix_type, dim, algo_name, data[:, :n_components])
+            elif data.size:
+                # e.g. LDA on too few classes for the higher dimension
+                self.jobs[mix_type][dim][algo_name] = {
+                    "status": "error",
+                    "error": f"only {data.shape[1]} components available"
+                }
+        job["status"] = "done"
+
+    @property
+    def version(self) -> str:
+        """Short digest of readiness and job statuses; changes whenever a projection lands."""
+        state = json.dumps([self.ready, self.jobs, self.approximate], sort_keys=True)
+        return hashlib.sha256(state.encode()).hexdigest()[:16]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by this dataset, per component and in total."""
+        usage = {
+            "X": self.X.nbytes,
+            "labels": self._labels_nbytes + self.label_codes.nbytes,
+            "landmarks": 0 if self.landmarks is None else self.landmarks.nbytes,
+            "lod_order": 0 if self._lod_order is None else self._lod_order.nbytes,
+            "quality_ranks": self._quality_ranks_nbytes(),
+            "projections": sum(stack.nbytes() for dims in self.projections.values() for stack in dims.values()),
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
+    def nbytes(self) -> int:
+        return self.memory_usage()["total"]
+
+    def has_projections(self) -> bool:
+        """True once at least one projection has been fitted or loaded."""
+        return any(len(stack) for dims in self.projections.values() for stack in dims.values())
+
+    def projections_payload(self) -> Dict:
+        """Projections as nested lists, for JSON responses."""
+        return {
+            mix_type: {dim: stack.to_lists() for dim, stack in dims.items()}
+            for mix_type, dims in self.projections.items()
+        }
+
+    def prepare_quality_ranks(self):
+        """Starts building the HD neighbour order in the background, if it is small enough to keep."""
+        if self._quality_ranks_task is None and len(self.X) <= QUALITY_RANKS_MAX_POINTS:
+            self._quality_ranks_task = asyncio.ensure_future(asyncio.to_thread(HighDimRanks, self.X))
+
+    async def quality_ranks(self) -> HighDimRanks:
+        """HD neighbour order shared by every quality curve of this dataset."""
+        if len(self.X) > QUALITY_RANKS_MAX_POINTS:
+            return await asyncio.to_thread(HighDimRanks, self.X)
+        self.prepare_quality_ranks()
+        return await asyncio.shield(self._quality_ranks_task)
+
+    def _quality_ranks_nbytes(self) -> int:
+        task = self._quality_ranks_task
+        if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+            return 0
+        return task.result().nbytes
+
+    def subsample(self, n: int, start: int = 0):
+        """
+        Row indices of a label-stratified subsample of at most n points. The order is
+        fixed per dataset, so a larger n extends a smaller one; start skips the rows
+        a client already has.
+        """
+        if self._lod_order is None:
+            self._lod_order = stratified_order(self.label_codes)
+        return self._lod_order[start:n]
 
     def get_data(self):
         return {
             "X": self.X.tolist(),
             "y": self.y,
-            "projections": self.projections,
+            "projections": self.projections_payload(),
+            "jobs": self.jobs,
+            "approximate": self.approximate,
             "ready": self.ready
         }
 
@@ -60,100 +347,26 @@ class Dataset:
         if self._cancel_flag:
             raise Exception("Cancelled")
 
-    def _compute_all_projections(self):
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(self.X)
-
-        # Reduced-dimension projections
-        self._check_cancel()
-        self._add_projection("reduced", "2d", "PCA", PCA(n_components=2).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "3d", "PCA", PCA(n_components=3).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "2d", "Truncated SVD", TruncatedSVD(n_components=2).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "3d", "Truncated SVD", TruncatedSVD(n_components=3).fit_transform(X_scaled))
-
+    def _prepare(self):
         self._check_cancel()
-        self._add_projection("reduced", "2d", "ICA", FastICA(n_components=2).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "3d", "ICA", FastICA(n_components=3).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "2d", "Factor Analysis", FactorAnalysis(n_components=2).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "3d", "Factor Analysis", FactorAnalysis(n_components=3).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "2d", "NMF", NMF(n_components=2, init='random', random_state=0).fit_transform(np.abs(X_scaled)))
-
-        self._check_cancel()
-        self._add_projection("reduced", "3d", "NMF", NMF(n_components=3, init='random', random_state=0).fit_transform(np.abs(X_scaled)))
-
-        self._check_cancel()
-        self._add_projection("reduced", "2d", "Random Projection", GaussianRandomProjection(n_components=2).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("reduced", "3d", "Random Projection", GaussianRandomProjection(n_components=3).fit_transform(X_scaled))
-
-        self._check_cancel()
-        if len(set(self.y)) < len(X_scaled):
-            try:
-                self._add_projection("reduced", "2d", "LDA", LDA(n_components=2).fit_transform(X_scaled, self.y))
-                self._add_projection("reduced", "3d", "LDA", LDA(n_components=3).fit_transform(X_scaled, self.y))
-            except Exception:
-                pass
-
-        # Kernel projections
-        self._check_cancel()
-        self._add_projection("kernel", "2d", "Kernel PCA", KernelPCA(n_components=2, kernel="rbf").fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "3d", "Kernel PCA", KernelPCA(n_components=3, kernel="rbf").fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "2d", "t-SNE", TSNE(n_components=2, perplexity=30).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "3d", "t-SNE", TSNE(n_components=3, perplexity=30).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "2d", "UMAP", self._try_umap(X_scaled, 2))
-
-        self._check_cancel()
-        self._add_projection("kernel", "3d", "UMAP", self._try_umap(X_scaled, 3))
-
-        self._check_cancel()
-        self._add_projection("kernel", "2d", "Isomap", Isomap(n_components=2).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "3d", "Isomap", Isomap(n_components=3).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "2d", "LLE", LocallyLinearEmbedding(n_components=2).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "3d", "LLE", LocallyLinearEmbedding(n_components=3).fit_transform(X_scaled))
-
-        self._check_cancel()
-        self._add_projection("kernel", "2d", "Spectral Embedding", SpectralEmbedding(n_components=2).fit_transform(X_scaled))
+        scaler = StandardScaler()
+        return scaler.fit_transform(self.X)
 
+    def _neighbors(self, X_scaled, k: int):
+        """kNN graph of the scaled data as (indices, distances), self excluded, or None if k is 0."""
+        if k <= 0:
+            return None
         self._check_cancel()
-        self._add_projection("kernel", "3d", "Spectral Embedding", SpectralEmbedding(n_components=3).fit_transform(X_scaled))
-
-    def _try_umap(self, X, n_components):
-        try:
-            import umap
-            reducer = umap.UMAP(n_components=n_components)
-            return reducer.fit_transform(X)
-        except ImportError:
-            return []
+        distances, indices = NearestNeighbors(n_neighbors=k).fit(X_scaled).kneighbors()
+        return indices, distances
 
     def _add_projection(self, mix_type: str, dim: str, algo_name: str, data):
         if data is not None and len(data) > 0:
-            self.projections[mix_type][dim][algo_name] = data.tolist()
+            self.projections[mix_type][dim][algo_name] = data
+            if uses_landmarks(algo_name, len(self.X)):
+                self.approximate[mix_type][dim][algo_name] = {
+                    "method": landmark_method(algo_name),
+                    "landmarks": len(self.landmarks)
+                }
+            # Clients can use each projection as soon as it lands
+            safe_notify_clients_projection_added(self.name, mix_type, dim, algo_name)
@@ -0,0 +1,244 @@
+# app/services/event_bus.py
+
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+import asyncio
+import json
+import os
+import queue
+import threading
+
+# Which backend carries events between workers: local (one process), postgres, memory (tests)
+EVENT_BUS = os.getenv("EVENT_BUS", "local")
+# Postgres backend, required there: LISTEN needs a session, so this must be a direct
+# endpoint; the app database URL is a transaction pooler, where LISTEN never hears anything
+EVENT_BUS_URL = os.getenv("EVENT_BUS_URL")
+EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "drbackend_events")
+# Seconds between reconnection attempts of the Postgres listener
+EVENT_BUS_RETRY = float(os.getenv("EVENT_BUS_RETRY", 5))
+
+# Event channels; the WebSocket layer delivers all of them, others may pick
+CHANNELS = ("projections", "progress", "forum")
+# NOTIFY payloads are limited to 8000 bytes
+_POSTGRES_MAX_PAYLOAD = 7900
+
+Deliver = Callable[[str, Dict, Optional[str]], None]
+
+
+class EventBus(ABC):
+    """
+    Publish/subscribe for events every worker's clients may care about.
+    publish() can be called from any thread, never blocks, and returns at once;
+    every started bus (one per worker) then calls its deliver(channel, event, key)
+    on the event loop it was started on, including the publishing worker's.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._deliver: Optional[Deliver] = None
+        self.published = 0
+        self.delivered = 0
+
+    async def start(self, deliver: Deliver):
+        """Starts delivering to deliver; calling it again is a no-op."""
+        if self._deliver is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._deliver = deliver
+
+    async def stop(self):
+        self._deliver = None
+
+    def publish(self, channel: str, event: Dict, key: Optional[str] = None):
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel '{channel}', expected one of {', '.join(CHANNELS)}")
+        self.published += 1
+        self._send({"channel": channel, "event": event, "key": key})
+
+    @abstractmethod
+    def _send(self, message: Dict):
+        """Carries one message to every started bus, this one included."""
+
+    def _dispatch(self, message: Dict):
+        if self._deliver is None:
+            return  # stopped, or never started: no clients in this process
+        self.delivered += 1
+        try:
+            self._deliver(message["channel"], message["event"], message.get("key"))
+        except Exception as e:
+            print(f"❌ Error delivering {message['channel']} event: {e}")
+
+    def _dispatch_threadsafe(self, message: Dict):
+        """Runs _dispatch on the bus loop, directly if already on it."""
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._dispatch(message)
+        else:
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+
+    def stats(self) -> Dict:
+        return {"backend": type(self).__name__, "published": self.published, "delivered": self.delivered}
+
+
+class LocalEventBus(EventBus):
+    """Single process: events go straight to this worker's loop."""
+
+    def _send(self, message: Dict):
+        self._dispatch_threadsafe(message)
+
+
+class MemoryEventBus(EventBus):
+    """
+    Test stand-in. Buses created on the same broker list behave like workers
+    sharing one backend: each sees every message, in publish order, and keeps
+    it in .messages even when not started.
+    """
+
+    def __init__(self, broker: Optional[List["MemoryEventBus"]] = None):
+        super().__init__()
+        self.broker = broker if broker is not None else []
+        self.broker.append(self)
+        self.messages: List[Dict] = []
+
+    def _send(self, message: Dict):
+        # Round-trip through JSON like a real backend, so unserializable events fail here too
+        message = json.loads(json.dumps(message))
+        for bus in list(self.broker):
+            bus.messages.append(message)
+            bus._dispatch_threadsafe(message)
+
+
+class PostgresEventBus(EventBus):
+    """
+    Postgres LISTEN/NOTIFY. Every worker listens on one channel from the event
+    loop (the connection's socket is watched with add_reader, no thread needed)
+    and publishes through a background thread, so a slow database never stalls
+    the loop. Events too large for NOTIFY, or published while the database is
+    unreachable, still reach this worker's own clients.
+    """
+
+    def __init__(self, url: str, channel: str = EVENT_BUS_CHANNEL):
+        super().__init__()
+        if not url:
+            raise ValueError("EVENT_BUS=postgres needs EVENT_BUS_URL, a direct (non-pooled) Postgres URL")
+        self.url = url
+        self.channel = channel
+        self._listener = None
+        self._retry = None
+        self._outbox: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        self._publisher = None
+
+    def _connect(self):
+        import psycopg2
+
+        connection = psycopg2.connect(self.url)
+        connection.autocommit = True
+        return connection
+
+    async def start(self, deliver: Deliver):
+        if self._deliver is not None:
+            return
+        await super().start(deliver)
+        self._publisher = threading.Thread(target=self._publish_loop, name="event-bus-publisher", daemon=True)
+        self._publisher.start()
+        await self._listen()
+
+    async def _listen(self):
+        self._retry = None
+        try:
+            connection = await asyncio.to_thread(self._connect)
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+        except Exception as e:
+            print(f"⚠️ Event bus could not listen on Postgres, retrying in {EVENT_BUS_RETRY}s: {e}")
+            self._retry = self.loop.call_later(EVENT_BUS_RETRY, lambda: asyncio.ensure_future(self._listen()))
+            return
+        self._listener = connection
+        self.loop.add_reader(connection.fileno(), self._on_notify)
+        print(f"📡 Event bus listening on Postgres channel '{self.channel}'")
+
+    def _on_notify(self):
+        try:
+            self._listener.poll()
+        except Exception as e:
+            print(f"⚠️ Event bus lost its Postgres listener: {e}")
+            self._close_listener()
+            self._retry = self.loop.call_later(EVENT_BUS_RETRY, lambda: asyncio.ensure_future(self._listen()))
+            return
+        while self._listener.notifies:
+            notify = self._listener.notifies.pop(0)
+            try:
+                message = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self._dispatch(message)
+
+    def _close_listener(self):
+        if self._listener is None:
+            return
+        try:
+            self.loop.remove_reader(self._listener.fileno())
+        except Exception:
+            pass
+        try:
+            self._listener.close()
+        except Exception:
+            pass
+        self._listener = None
+
+    def _send(self, message: Dict):
+        if self._publisher is None:
+            self._dispatch_threadsafe(message)  # not started: nothing to reach beyond this worker
+            return
+        payload = json.dumps(message)
+        if len(payload.encode()) > _POSTGRES_MAX_PAYLOAD:
+            print(f"⚠️ {message['channel']} event too large for NOTIFY, delivered to this worker only")
+            self._dispatch_threadsafe(message)
+            return
+        self._outbox.put(message)
+
+    def _publish_loop(self):
+        connection = None
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                break
+            try:
+                if connection is None or connection.closed:
+                    connection = self._connect()
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, json.dumps(message)))
+            except Exception as e:
+                print(f"⚠️ Event bus could not publish to Postgres, delivering locally: {e}")
+                connection = None
+                self._dispatch_threadsafe(message)
+        if connection is not None:
+            connection.close()
+
+    async def stop(self):
+        await super().stop()
+        if self._retry is not None:
+            self._retry.cancel()
+        self._close_listener()
+        if self._publisher is not None:
+            self._outbox.put(None)
+            await asyncio.to_thread(self._publisher.join, 5)
+            self._publisher = None
+
+
+def create_event_bus(backend: str = EVENT_BUS) -> EventBus:
+    if backend == "local":
+        return LocalEventBus()
+    if backend == "postgres":
+        return PostgresEventBus(EVENT_BUS_URL)
+    if backend == "memory":
+        return MemoryEventBus()
+    raise ValueError(f"Unknown EVENT_BUS '{backend}', expected local, postgres or memory")
+
+
+event_bus = create_event_bus()
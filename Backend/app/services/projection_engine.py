@@ -0,0 +1,517 @@
+# app/services/projection_engine.py
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from sklearn.decomposition import PCA, TruncatedSVD, FastICA, FactorAnalysis, NMF, KernelPCA
+from sklearn.manifold import TSNE, Isomap, LocallyLinearEmbedding, SpectralEmbedding
+from sklearn.random_projection import GaussianRandomProjection
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
+from sklearn.neighbors import NearestNeighbors
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+import numpy as np
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import warnings
+
+warnings.filterwarnings("ignore")
+
+# Number of worker processes used to fit projections (defaults to one per core)
+PROJECTION_WORKERS = int(os.getenv("PROJECTION_WORKERS", os.cpu_count() or 1))
+
+# How job processes are started; forkserver forks from a clean, preloaded server
+# instead of from the multi-threaded web process
+PROJECTION_START_METHOD = os.getenv(
+    "PROJECTION_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Seed for every stochastic estimator, so identical inputs give identical projections
+RANDOM_STATE = 0
+
+DIMENSIONS = {"2d": 2, "3d": 3}
+
+# (mix_type, algorithm name) in the order the jobs are submitted
+ALGORITHMS = [
+    ("reduced", "PCA"),
+    ("reduced", "Truncated SVD"),
+    ("reduced", "ICA"),
+    ("reduced", "Factor Analysis"),
+    ("reduced", "NMF"),
+    ("reduced", "Random Projection"),
+    ("reduced", "LDA"),
+    ("kernel", "Kernel PCA"),
+    ("kernel", "t-SNE"),
+    ("kernel", "UMAP"),
+    ("kernel", "Isomap"),
+    ("kernel", "LLE"),
+    ("kernel", "Spectral Embedding"),
+]
+
+# Methods whose lower-dimensional embedding is the leading columns of a
+# higher-dimensional one (eigen/SVD solutions); these are fitted only once
+NESTED_ALGORITHMS = {
+    "PCA", "Truncated SVD", "LDA", "Kernel PCA", "Isomap", "LLE", "Spectral Embedding",
+}
+
+
+# Relative fitting cost of each method; cheap ones are scheduled first
+EXPECTED_COST = {
+    "PCA": 1,
+    "Truncated SVD": 1,
+    "Random Projection": 1,
+    "LDA": 1,
+    "Factor Analysis": 2,
+    "ICA": 2,
+    "NMF": 3,
+    "LLE": 10,
+    "Spectral Embedding": 15,
+    "Kernel PCA": 20,
+    "Isomap": 20,
+    "UMAP": 30,
+    "t-SNE": 40,
+}
+
+
+def expected_cost(algo_name: str, n_components: int) -> float:
+    return EXPECTED_COST.get(algo_name, 10) * n_components / 2
+
+
+def projection_jobs():
+    """
+    Yields (mix_type, algo_name, n_components, dims) for every fit to run.
+    Nested methods get a single job at the highest dimension covering all dims.
+    """
+    top = max(DIMENSIONS.values())
+    for mix_type, algo_name in ALGORITHMS:
+        if algo_name in NESTED_ALGORITHMS:
+            yield mix_type, algo_name, top, list(DIMENSIONS)
+        else:
+            for dim, n_components in DIMENSIONS.items():
+                yield mix_type, algo_name, n_components, [dim]
+
+
+# Neighbourhood sizes of the graph-based methods; these read the shared kNN graph
+TSNE_PERPLEXITY = 30
+UMAP_NEIGHBORS = 15
+ISOMAP_NEIGHBORS = 5
+
+
+# Above LANDMARK_THRESHOLD rows the quadratic methods are fitted on LANDMARK_COUNT
+# label-stratified landmarks and the other points are placed afterwards
+LANDMARK_THRESHOLD = int(os.getenv("LANDMARK_THRESHOLD", 20000))
+LANDMARK_COUNT = int(os.getenv("LANDMARK_COUNT", 5000))
+LANDMARK_ALGORITHMS = {"t-SNE", "Isomap", "LLE", "Spectral Embedding", "Kernel PCA"}
+# Landmark methods that can place new points themselves; the rest use kNN interpolation
+NATIVE_TRANSFORM = {"Isomap", "LLE", "Kernel PCA"}
+INTERPOLATION_NEIGHBORS = 10
+
+
+def uses_landmarks(algo_name: str, n_samples: int) -> bool:
+    return algo_name in LANDMARK_ALGORITHMS and n_samples > LANDMARK_THRESHOLD
+
+
+def landmark_method(algo_name: str) -> str:
+    return "transform" if algo_name in NATIVE_TRANSFORM else "knn_interpolation"
+
+
+def stratified_landmarks(y, n_landmarks: int):
+    """
+    Picks n_landmarks row indices with every label represented in proportion
+    to its frequency (at least one each). Seeded, so the choice is stable.
+    """
+    y = np.asarray(y)
+    rng = np.random.RandomState(RANDOM_STATE)
+    labels, inverse, counts = np.unique(y, return_inverse=True, return_counts=True)
+    quotas = np.maximum(1, np.round(counts * n_landmarks / len(y)).astype(int))
+    picked = [
+        rng.choice(np.flatnonzero(inverse == i), size=min(quota, count), replace=False)
+        for i, (quota, count) in enumerate(zip(quotas, counts))
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def stratified_order(label_codes):
+    """
+    Seeded permutation of the rows in which every prefix is stratified by label:
+    each label's rows are spread evenly through the order, and every label
+    appears within the first len(labels) positions.
+    """
+    label_codes = np.asarray(label_codes)
+    counts = np.bincount(label_codes)
+    rng = np.random.RandomState(RANDOM_STATE)
+    # Shuffled within each label, grouped by label
+    rows = rng.permutation(len(label_codes))
+    rows = rows[np.argsort(label_codes[rows], kind="stable")]
+    sizes = counts[label_codes[rows]]
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    # A row's place in the order is its fraction of the way through its label
+    fraction = (np.arange(len(rows)) - starts) / sizes
+    return rows[np.lexsort((label_codes[rows], fraction))].astype(np.int32)
+
+
+def neighbors_needed(algo_name: str, n_samples: int) -> int:
+    """Number of neighbours, self excluded, an algorithm reads from the shared graph (0 if none)."""
+    if uses_landmarks(algo_name, n_samples):
+        return 0  # fitted on landmarks, not on the full graph
+    if algo_name == "t-SNE":
+        k = int(3.0 * TSNE_PERPLEXITY + 1)
+    elif algo_name == "UMAP":
+        k = UMAP_NEIGHBORS - 1  # UMAP counts the point itself as a neighbour
+    elif algo_name == "Isomap":
+        k = ISOMAP_NEIGHBORS
+    elif algo_name == "Spectral Embedding":
+        # SpectralEmbedding's own default, which counts the point itself
+        k = max(int(n_samples / 10), 1) - 1
+    else:
+        return 0
+    return min(k, n_samples - 1)
+
+
+def max_neighbors(n_samples: int) -> int:
+    """Size of the shared kNN graph: the largest k any algorithm asks for."""
+    return max(neighbors_needed(algo_name, n_samples) for _, algo_name in ALGORITHMS)
+
+
+def _with_self(neighbors):
+    """Prepends each point as its own nearest neighbour at distance 0."""
+    indices, distances = neighbors
+    n_samples = len(indices)
+    return (np.hstack([np.arange(n_samples)[:, None], indices]),
+            np.hstack([np.zeros((n_samples, 1)), distances]))
+
+
+def _knn_graph(neighbors, squared: bool = False):
+    """
+    Builds a sparse distance graph from (indices, distances).
+    The explicit zero self-entries let sklearn recognise and drop the query point.
+    """
+    indices, distances = _with_self(neighbors)
+    n_samples, k = indices.shape
+    data = distances ** 2 if squared else distances
+    indptr = np.arange(0, n_samples * k + 1, k)
+    return csr_matrix((data.ravel(), indices.ravel(), indptr), shape=(n_samples, n_samples))
+
+
+def _try_umap(X, n_components, neighbors=None):
+    try:
+        import umap
+        if neighbors is None:
+            reducer = umap.UMAP(n_components=n_components, random_state=RANDOM_STATE)
+        else:
+            knn_indices, knn_dists = _with_self(neighbors)
+            reducer = umap.UMAP(n_components=n_components, n_neighbors=knn_indices.shape[1],
+                                precomputed_knn=(knn_indices, knn_dists), random_state=RANDOM_STATE)
+        return reducer.fit_transform(X)
+    except ImportError:
+        return []
+
+
+def _fit_tsne(X, n_components, neighbors=None):
+    if neighbors is None:
+        return TSNE(n_components=n_components, perplexity=TSNE_PERPLEXITY,
+                    random_state=RANDOM_STATE).fit_transform(X)
+    # Same PCA initialisation TSNE uses internally, which it refuses for precomputed input
+    init = PCA(n_components=n_components, svd_solver="randomized",
+               random_state=RANDOM_STATE).fit_transform(X).astype(np.float32)
+    init = init / np.std(init[:, 0]) * 1e-4
+    # TSNE squares euclidean distances itself, but not precomputed ones
+    graph = _knn_graph(neighbors, squared=True)
+    return TSNE(n_components=n_components, perplexity=TSNE_PERPLEXITY, metric="precomputed",
+                init=init, random_state=RANDOM_STATE).fit_transform(graph)
+
+
+def _fit_isomap(X, n_components, neighbors=None):
+    if neighbors is not None:
+        graph = _knn_graph(neighbors)
+        # A precomputed graph must be connected; from X, Isomap joins the components itself
+        if connected_components(graph, directed=False)[0] == 1:
+            return Isomap(n_components=n_components, n_neighbors=ISOMAP_NEIGHBORS,
+                          metric="precomputed").fit_transform(graph)
+    return Isomap(n_components=n_components, n_neighbors=ISOMAP_NEIGHBORS).fit_transform(X)
+
+
+def _fit_spectral(X, n_components, neighbors=None):
+    if neighbors is None:
+        return SpectralEmbedding(n_components=n_components, random_state=RANDOM_STATE).fit_transform(X)
+    return SpectralEmbedding(n_components=n_components, affinity="precomputed_nearest_neighbors",
+                             n_neighbors=neighbors[0].shape[1] + 1,
+                             random_state=RANDOM_STATE).fit_transform(_knn_graph(neighbors))
+
+
+def _fit_lda(X, y, n_components):
+    n_classes = len(set(y))
+    if n_classes >= len(X):
+        raise ValueError("LDA needs fewer classes than samples")
+    # LDA yields at most n_classes - 1 components; lower dims are still usable
+    n_components = min(n_components, n_classes - 1, X.shape[1])
+    return LDA(n_components=n_components).fit_transform(X, y)
+
+
+_BUILDERS = {
+    "PCA": lambda X, y, n, nb: PCA(n_components=n, random_state=RANDOM_STATE).fit_transform(X),
+    "Truncated SVD": lambda X, y, n, nb: TruncatedSVD(n_components=n, random_state=RANDOM_STATE).fit_transform(X),
+    "ICA": lambda X, y, n, nb: FastICA(n_components=n, random_state=RANDOM_STATE).fit_transform(X),
+    "Factor Analysis": lambda X, y, n, nb: FactorAnalysis(n_components=n, random_state=RANDOM_STATE).fit_transform(X),
+    "NMF": lambda X, y, n, nb: NMF(n_components=n, init='random', random_state=RANDOM_STATE).fit_transform(np.abs(X)),
+    "Random Projection": lambda X, y, n, nb: GaussianRandomProjection(n_components=n, random_state=RANDOM_STATE).fit_transform(X),
+    "LDA": lambda X, y, n, nb: _fit_lda(X, y, n),
+    "Kernel PCA": lambda X, y, n, nb: KernelPCA(n_components=n, kernel="rbf", random_state=RANDOM_STATE).fit_transform(X),
+    "t-SNE": lambda X, y, n, nb: _fit_tsne(X, n, nb),
+    "UMAP": lambda X, y, n, nb: _try_umap(X, n, nb),
+    "Isomap": lambda X, y, n, nb: _fit_isomap(X, n, nb),
+    # LLE needs the raw coordinates of each neighbourhood to solve its reconstruction weights
+    "LLE": lambda X, y, n, nb: LocallyLinearEmbedding(n_components=n, random_state=RANDOM_STATE).fit_transform(X),
+    "Spectral Embedding": lambda X, y, n, nb: _fit_spectral(X, n, nb),
+}
+
+
+def pipeline_fingerprint() -> dict:
+    """Everything besides the data that determines the projections; part of the cache key."""
+    import sklearn
+    return {
+        "algorithms": ALGORITHMS,
+        "dimensions": DIMENSIONS,
+        "nested": sorted(NESTED_ALGORITHMS),
+        "random_state": RANDOM_STATE,
+        "tsne_perplexity": TSNE_PERPLEXITY,
+        "umap_neighbors": UMAP_NEIGHBORS,
+        "isomap_neighbors": ISOMAP_NEIGHBORS,
+        "landmark_threshold": LANDMARK_THRESHOLD,
+        "landmark_count": LANDMARK_COUNT,
+        "interpolation_neighbors": INTERPOLATION_NEIGHBORS,
+        "sklearn": sklearn.__version__,
+    }
+
+
+def _landmark_estimator(algo_name: str, n_components: int):
+    if algo_name == "Isomap":
+        return Isomap(n_components=n_components, n_neighbors=ISOMAP_NEIGHBORS)
+    if algo_name == "LLE":
+        return LocallyLinearEmbedding(n_components=n_components, random_state=RANDOM_STATE)
+    return KernelPCA(n_components=n_components, kernel="rbf", random_state=RANDOM_STATE)
+
+
+def _fit_landmarks(algo_name: str, n_components: int, X, y, landmarks):
+    """Fits on the landmark rows only, then places every other row."""
+    X_landmarks = X[landmarks]
+    if algo_name in NATIVE_TRANSFORM:
+        estimator = _landmark_estimator(algo_name, n_components)
+        embedding = estimator.fit_transform(X_landmarks)
+        result = estimator.transform(X)
+    else:
+        y_landmarks = [y[i] for i in landmarks]
+        embedding = np.asarray(_BUILDERS[algo_name](X_landmarks, y_landmarks, n_components, None))
+        # Inverse-distance weighted mean of the nearest landmarks' coordinates
+        k = min(INTERPOLATION_NEIGHBORS, len(landmarks))
+        distances, indices = NearestNeighbors(n_neighbors=k).fit(X_landmarks).kneighbors(X)
+        weights = 1.0 / np.maximum(distances, 1e-12)
+        weights /= weights.sum(axis=1, keepdims=True)
+        result = np.einsum("nk,nkd->nd", weights, embedding[indices])
+    result[landmarks] = embedding  # landmarks keep their fitted coordinates
+    return result
+
+
+def fit_projection(algo_name: str, n_components: int, X_scaled, y, neighbors=None, landmarks=None):
+    """
+    Fits a single algorithm and returns its embedding.
+    Runs inside a worker process, so it only receives picklable arguments.
+    `neighbors` is the (indices, distances) slice of the shared kNN graph;
+    `landmarks` switches the landmark methods to a fit on those rows only.
+    """
+    if landmarks is not None and algo_name in LANDMARK_ALGORITHMS:
+        return _fit_landmarks(algo_name, n_components, X_scaled, y, landmarks)
+    return _BUILDERS[algo_name](X_scaled, y, n_components, neighbors)
+
+
+class JobCancelled(Exception):
+    """Raised for a job whose worker process was killed by cancel()."""
+
+
+def _job_process_main(conn, args):
+    """Entry point of a job process: fit, send the result back, exit."""
+    try:
+        result = ("ok", fit_projection(*args))
+    except Exception as e:
+        result = ("error", e)
+    try:
+        conn.send(result)
+    except Exception as e:
+        # Unpicklable result or exception
+        conn.send(("error", RuntimeError(str(e))))
+    finally:
+        conn.close()
+
+
+class ProjectionJob:
+    """One pending or running fit. `future` resolves to the embedding."""
+
+    def __init__(self, algo_name: str, n_components: int, args: tuple, priority: float):
+        self.algo_name = algo_name
+        self.n_components = n_components
+        self.args = args
+        self.priority = priority
+        self.future = Future()
+        self.dispatched = False
+        self.process = None
+        self.cancelled = False
+
+
+class ProjectionEngine:
+    """
+    Runs projection jobs in separate processes across CPU cores.
+    Jobs wait in a priority queue (lowest expected cost first) and only get a
+    process when a worker slot is free, so they can still be reordered.
+    Every job has its own process, so cancel() can kill it mid-fit.
+    """
+
+    def __init__(self, max_workers: int = PROJECTION_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self._supervisors = None
+        self._context = None
+        self._queue = []  # heap of (priority, seq, job); stale entries are skipped
+        self._seq = itertools.count()
+        self._promotions = itertools.count()
+        self._running = set()
+        self._lock = threading.Lock()
+
+    @property
+    def supervisors(self) -> ThreadPoolExecutor:
+        # Created lazily so importing this module never starts threads or processes.
+        # Each supervisor thread owns one job process and waits for its result.
+        if self._supervisors is None:
+            self._supervisors = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                   thread_name_prefix="projection")
+            self._context = multiprocessing.get_context(PROJECTION_START_METHOD)
+            if PROJECTION_START_METHOD == "forkserver":
+                # Imported once in the server, so job processes start in milliseconds;
+                # the warm-up also compiles UMAP's numba code there, once for every job
+                # (missing optional modules are skipped)
+                self._context.set_forkserver_preload([__name__, "app.services.projection_warmup"])
+        return self._supervisors
+
+    def start(self) -> None:
+        """Starts the forkserver now, so its warm-up overlaps startup instead of the first job."""
+        self.supervisors
+        if PROJECTION_START_METHOD == "forkserver":
+            from multiprocessing import forkserver
+            forkserver.ensure_running()
+
+    def submit(self, algo_name: str, n_components: int, X_scaled, y, neighbors=None,
+               landmarks=None) -> ProjectionJob:
+        """Queues one job by expected cost and returns it."""
+        job = ProjectionJob(algo_name, n_components, (algo_name, n_components, X_scaled, y, neighbors, landmarks),
+                            expected_cost(algo_name, n_components))
+        with self._lock:
+            heapq.heappush(self._queue, (job.priority, next(self._seq), job))
+        self._dispatch()
+        return job
+
+    def promote(self, job: ProjectionJob) -> None:
+        """
+        Moves a queued job ahead of everything not yet promoted.
+        Running or finished jobs are left alone so their work is reused.
+        """
+        with self._lock:
+            if job.dispatched or job.future.done() or job.priority < 0:
+                return
+            # Negative priorities sort first; earlier promotions keep precedence
+            job.priority = -1e9 + next(self._promotions)
+            heapq.heappush(self._queue, (job.priority, next(self._seq), job))
+
+    def cancel(self, job: ProjectionJob) -> None:
+        """Drops a queued job, or kills the process of a running one."""
+        with self._lock:
+            job.cancelled = True
+            if job.future.cancel():
+                return  # was still queued
+            process = job.process
+        if process is not None and process.is_alive():
+            process.terminate()
+
+    def stats(self) -> dict:
+        """Snapshot of the queue and of the job processes that are still alive."""
+        with self._lock:
+            queued = sum(1 for priority, _, job in self._queue
+                         if priority == job.priority and not job.dispatched and not job.future.done())
+            running = list(self._running)
+        return {
+            "max_workers": self.max_workers,
+            "queued": queued,
+            "running": len(running),
+            "alive_processes": sum(1 for job in running if job.process is not None and job.process.is_alive()),
+            "running_jobs": [f"{job.algo_name} ({job.n_components}D)" for job in running],
+        }
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if len(self._running) >= self.max_workers:
+                    return
+                job = self._pop()
+                if job is None:
+                    return
+                self._running.add(job)
+            self.supervisors.submit(self._supervise, job)
+
+    def _pop(self):
+        """Next live job from the heap; called with the lock held."""
+        while self._queue:
+            priority, _, job = heapq.heappop(self._queue)
+            if job.dispatched or priority != job.priority:
+                continue  # superseded by a promotion
+            if not job.future.set_running_or_notify_cancel():
+                continue  # cancelled while queued
+            job.dispatched = True
+            return job
+        return None
+
+    def _supervise(self, job: ProjectionJob):
+        """Runs one job process to completion (or until it is killed)."""
+        try:
+            parent_conn, child_conn = self._context.Pipe(duplex=False)
+            process = self._context.Process(target=_job_process_main, args=(child_conn, job.args), daemon=True)
+            with self._lock:
+                if job.cancelled:
+                    raise JobCancelled(job.algo_name)
+                job.process = process
+                process.start()
+            child_conn.close()
+            try:
+                status, value = parent_conn.recv()
+            except EOFError:
+                # The process died without answering: killed by cancel() or crashed
+                status, value = "error", (JobCancelled(job.algo_name) if job.cancelled
+                                          else RuntimeError(f"worker exited with code {process.exitcode}"))
+            finally:
+                parent_conn.close()
+                process.join()
+            if status == "ok":
+                job.future.set_result(value)
+            else:
+                job.future.set_exception(value)
+        except Exception as e:
+            job.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running.discard(job)
+                job.process = None
+                job.args = None  # the data and kNN graph are not needed anymore
+            self._dispatch()
+
+    def shutdown(self):
+        """Cancels every queued and running job; the engine starts afresh if used again."""
+        with self._lock:
+            jobs = list(self._running) + [job for _, _, job in self._queue]
+            self._queue = []
+        for job in jobs:
+            self.cancel(job)
+        if self._supervisors is not None:
+            self._supervisors.shutdown(wait=False, cancel_futures=True)
+            self._supervisors = None
+
+
+# Shared by every dataset of this process
+projection_engine = ProjectionEngine()
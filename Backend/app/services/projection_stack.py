@@ -0,0 +1,164 @@
+# app/services/projection_stack.py
+
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, List
+import os
+import threading
+import numpy as np
+from scipy.linalg import orthogonal_procrustes
+
+# Recent blends kept per stack, since users toggle between the same settings
+BLEND_CACHE_SIZE = int(os.getenv("BLEND_CACHE_SIZE", 16))
+ALIGNMENTS = ("none", "procrustes")
+
+
+class ProjectionStack(Mapping):
+    """
+    All projections of a dataset for one mix type and dimension, kept in a single
+    contiguous float32 tensor of shape (n_algorithms, n_samples, n_components).
+    Reads like a dict of algorithm name -> read-only (n_samples, n_components) view.
+    Blending is safe from worker threads while projections keep landing.
+    """
+
+    def __init__(self, algorithms: List[str], n_samples: int, n_components: int):
+        self.slots = {name: i for i, name in enumerate(algorithms)}
+        self.n_samples = n_samples
+        self.n_components = n_components
+        self.tensor = None  # allocated when the first projection lands
+        self._filled = set()
+        self._aligned = {}  # reference name -> tensor aligned onto it, built on first use
+        self._blends = OrderedDict()  # (alignment, weights) -> recent blend
+        self._lock = threading.RLock()
+
+    def __setitem__(self, name: str, data) -> None:
+        data = np.asarray(data, dtype=np.float32)
+        if data.shape != (self.n_samples, self.n_components):
+            raise ValueError(f"{name}: expected shape {(self.n_samples, self.n_components)}, got {data.shape}")
+        with self._lock:
+            if self.tensor is None:
+                self.tensor = np.zeros((len(self.slots), self.n_samples, self.n_components), dtype=np.float32)
+            if name not in self.slots:
+                # Not one of the configured algorithms: append a slot for it
+                self.slots[name] = len(self.slots)
+                self.tensor = np.concatenate([self.tensor, data[np.newaxis]])
+            self.tensor[self.slots[name]] = data
+            self._filled.add(name)
+            # Aligned copies and cached blends may include the replaced projection
+            self._aligned.clear()
+            self._blends.clear()
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self._filled:
+            raise KeyError(name)
+        view = self.tensor[self.slots[name]]
+        view.flags.writeable = False
+        return view
+
+    def __iter__(self):
+        # Configured algorithm order, not arrival order, so payloads are stable
+        return (name for name in self.slots if name in self._filled)
+
+    def __len__(self) -> int:
+        return len(self._filled)
+
+    def stack(self, names: List[str]) -> np.ndarray:
+        """(len(names), n_samples, n_components) tensor of the named projections."""
+        for name in names:
+            if name not in self._filled:
+                raise KeyError(name)
+        return self.tensor[[self.slots[name] for name in names]]
+
+    def weight_vector(self, weights: Dict[str, float]) -> np.ndarray:
+        """Weights over every slot, zero for unused ones; KeyError if a projection is missing."""
+        with self._lock:
+            vector = np.zeros(len(self.slots))
+            for name, weight in weights.items():
+                if name not in self._filled:
+                    raise KeyError(name)
+                vector[self.slots[name]] += weight
+            return vector
+
+    def aligned(self, reference: str) -> np.ndarray:
+        """
+        The tensor with each projection centered, scaled to unit RMS norm and
+        rotated onto the reference projection by orthogonal Procrustes, so blends
+        average shapes instead of arbitrary orientations and scales.
+        """
+        with self._lock:
+            if reference not in self._aligned:
+                aligned = np.zeros_like(self.tensor)
+                target = self._normalized(reference)
+                for name in self:
+                    points = self._normalized(name)
+                    if name != reference:
+                        rotation, _ = orthogonal_procrustes(points, target)
+                        points = points @ rotation
+                    aligned[self.slots[name]] = points
+                self._aligned[reference] = aligned
+            return self._aligned[reference]
+
+    def _normalized(self, name: str) -> np.ndarray:
+        points = self[name] - self[name].mean(axis=0)
+        points /= max(np.sqrt(np.mean(np.sum(points ** 2, axis=1))), np.finfo(np.float32).tiny)
+        return points
+
+    def _reference(self, vector: np.ndarray) -> str:
+        """
+        The blended projection the others are aligned onto: the first one in slot
+        order, so it depends only on what is blended, not on what else has landed
+        or on the order the weights were listed in.
+        """
+        names = list(self.slots)
+        return names[int(np.flatnonzero(vector)[0])] if np.any(vector) else next(iter(self))
+
+    def _source(self, alignment: str, vector: np.ndarray) -> np.ndarray:
+        if alignment not in ALIGNMENTS:
+            raise ValueError(f"Unknown alignment '{alignment}', expected one of {', '.join(ALIGNMENTS)}")
+        return self.aligned(self._reference(vector)) if alignment == "procrustes" else self.tensor
+
+    def blend(self, weights: Dict[str, float], alignment: str = "none") -> np.ndarray:
+        """
+        Weighted sum of projections (weights as fractions) as one contraction over
+        the whole tensor; returns a read-only (n_samples, n_components) float64 array.
+        """
+        with self._lock:
+            vector = self.weight_vector(weights)
+            key = (alignment, tuple(np.round(vector, 12)))
+            if key in self._blends:
+                self._blends.move_to_end(key)
+                return self._blends[key]
+            blended = np.einsum("a,and->nd", vector, self._source(alignment, vector), dtype=np.float64,
+                                casting="safe")
+            blended.flags.writeable = False
+            self._blends[key] = blended
+            while len(self._blends) > BLEND_CACHE_SIZE:
+                self._blends.popitem(last=False)
+            return blended
+
+    def blend_many(self, names: List[str], weights, alignment: str = "none") -> np.ndarray:
+        """
+        Blends the named projections with each row of weights (fractions, shape
+        (n_blends, len(names))) in one contraction; returns (n_blends, n_samples, n_components).
+        """
+        with self._lock:
+            vectors = np.stack([self.weight_vector(dict(zip(names, row))) for row in np.asarray(weights)])
+            if alignment == "none" or alignment not in ALIGNMENTS:
+                return np.einsum("ba,and->bnd", vectors, self._source(alignment, vectors[0]),
+                                 dtype=np.float64, casting="safe")
+            # Each row is aligned onto its own reference, exactly as blend() would
+            blends = np.empty((len(vectors), self.n_samples, self.n_components))
+            references = [self._reference(vector) for vector in vectors]
+            for reference in set(references):
+                rows = [i for i, name in enumerate(references) if name == reference]
+                blends[rows] = np.einsum("ba,and->bnd", vectors[rows], self.aligned(reference),
+                                         dtype=np.float64, casting="safe")
+            return blends
+
+    def nbytes(self) -> int:
+        cached = [self.tensor, *self._aligned.values(), *self._blends.values()]
+        return sum(array.nbytes for array in cached if array is not None)
+
+    def to_lists(self) -> Dict[str, List[List[float]]]:
+        """Nested lists for JSON responses; the only place projections leave float32."""
+        return {name: self[name].tolist() for name in self}
@@ -0,0 +1,75 @@
+# app/services/projection_store.py
+
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import numpy as np
+from app.services.projection_engine import pipeline_fingerprint, projection_jobs
+
+# Finished projections are kept here across restarts, one .npz file per key
+PROJECTION_CACHE_FOLDER = os.getenv("PROJECTION_CACHE_FOLDER", "ProjectionCache")
+
+_SEPARATOR = "|"
+# Entry holding the pairs that failed, as JSON, so a load doesn't fit them again
+_ERRORS = "errors"
+
+
+def cache_key(csv_bytes: bytes) -> str:
+    """Content hash of the CSV plus the algorithm parameters and seeds."""
+    digest = hashlib.sha256(csv_bytes)
+    digest.update(json.dumps(pipeline_fingerprint(), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def is_complete(projections: Dict) -> bool:
+    """True if projections hold every (algorithm, dimension) pair the pipeline fits."""
+    return all(algo_name in projections.get(mix_type, {}).get(dim, {})
+               for mix_type, algo_name, _, dims in projection_jobs() for dim in dims)
+
+
+def _path(key: str) -> str:
+    return os.path.join(PROJECTION_CACHE_FOLDER, f"{key}.npz")
+
+
+def load(key: str) -> Optional[Tuple[Dict, Dict]]:
+    """
+    Returns the stored projections for key as float32 arrays, and the error of
+    each pair that failed (same nesting), or None on a miss.
+    """
+    path = _path(key)
+    if not os.path.exists(path):
+        return None
+    projections, errors = {}, {}
+    try:
+        with np.load(path) as stored:
+            for entry in stored.files:
+                if entry == _ERRORS:
+                    errors = json.loads(str(stored[entry]))
+                    continue
+                mix_type, dim, algo_name = entry.split(_SEPARATOR)
+                projections.setdefault(mix_type, {}).setdefault(dim, {})[algo_name] = stored[entry]
+    except Exception as e:
+        print(f"Ignoring unreadable projection cache {path}: {e}")
+        return None
+    return projections, errors
+
+
+def save(key: str, projections: Dict, errors: Optional[Dict] = None) -> None:
+    """
+    Writes the projections as float32 arrays, plus the errors of failed pairs;
+    the rename makes the write atomic.
+    """
+    os.makedirs(PROJECTION_CACHE_FOLDER, exist_ok=True)
+    arrays = {
+        _SEPARATOR.join((mix_type, dim, algo_name)): np.asarray(data, dtype=np.float32)
+        for mix_type, dims in projections.items()
+        for dim, algos in dims.items()
+        for algo_name, data in algos.items()
+    }
+    if errors:
+        arrays[_ERRORS] = np.array(json.dumps(errors))
+    tmp_path = _path(key) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, _path(key))
@@ -0,0 +1,35 @@
+# app/services/projection_warmup.py
+"""
+Preloaded by the projection forkserver. Importing it runs a tiny fit of every
+numba-compiled estimator, so the compiled code already lives in the server and
+every forked job process inherits it instead of recompiling it (seconds per fit).
+"""
+
+import warnings
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from app.services.projection_engine import fit_projection, neighbors_needed
+
+# Estimators whose first fit in a process pays for numba compilation
+JIT_ALGORITHMS = ["UMAP"]
+WARMUP_SAMPLES = 200
+
+
+def warm_up():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(WARMUP_SAMPLES, 3))
+    y = [str(i % 2) for i in range(WARMUP_SAMPLES)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for algo_name in JIT_ALGORITHMS:
+            k = neighbors_needed(algo_name, WARMUP_SAMPLES)
+            distances, indices = NearestNeighbors(n_neighbors=k).fit(X).kneighbors()
+            try:
+                # Same call shapes and dtypes as real jobs, with and without the shared graph
+                fit_projection(algo_name, 2, X, y, (indices, distances))
+                fit_projection(algo_name, 2, X, y, None)
+            except Exception as e:
+                print(f"⚠️ Could not warm up {algo_name}: {e}")
+
+
+warm_up()
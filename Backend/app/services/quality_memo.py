@@ -0,0 +1,73 @@
+# app/services/quality_memo.py
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+import os
+
+# Quality curves remembered across all datasets
+QUALITY_MEMO_SIZE = int(os.getenv("QUALITY_MEMO_SIZE", 256))
+# Percentages are rounded to this many decimals before lookup
+QUALITY_MEMO_DECIMALS = int(os.getenv("QUALITY_MEMO_DECIMALS", 1))
+
+
+class QualityCurveMemo:
+    """
+    Bounded LRU of computed quality curves. Slider-driven clients keep sending
+    the same blends, so each distinct (dataset, dimension, mix, weights) is
+    computed once until it falls out or its dataset goes away.
+    """
+
+    def __init__(self, max_entries: int = QUALITY_MEMO_SIZE, decimals: int = QUALITY_MEMO_DECIMALS):
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, dataset_name: str, content_key: Optional[str], dim: str, mix_type: str,
+            weights: Iterable[Tuple[str, float]], alignment: str = "none") -> tuple:
+        """Canonical key: rounded weights, zero weights dropped, order and repeats ignored."""
+        merged: Dict[str, float] = {}
+        for name, percentage in weights:
+            merged[name] = merged.get(name, 0.0) + percentage
+        canonical = tuple(sorted(
+            (name, round(percentage, self.decimals))
+            for name, percentage in merged.items()
+            if round(percentage, self.decimals) != 0
+        ))
+        return dataset_name, content_key, dim, mix_type, alignment, canonical
+
+    def get(self, key):
+        result = self._entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result) -> None:
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, dataset_name: str) -> int:
+        """Drops every curve of a dataset; returns how many were dropped."""
+        stale = [key for key in self._entries if key[0] == dataset_name]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+        return len(stale)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,208 @@
+# app/services/rank_quality.py
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import asyncio
+import os
+import numpy as np
+from sklearn.metrics.pairwise import pairwise_distances
+
+# Above this many points the N x N neighbour order is too big to keep per dataset
+QUALITY_RANKS_MAX_POINTS = int(os.getenv("QUALITY_RANKS_MAX_POINTS", 8000))
+# Threads evaluating batched curves; the sorts and distance kernels release the GIL
+QUALITY_WORKERS = int(os.getenv("QUALITY_WORKERS", os.cpu_count() or 1))
+# Working memory all curves and metrics computed at once may use together
+QUALITY_MEMORY_BUDGET = int(os.getenv("QUALITY_MEMORY_BUDGET", 4 * 1024 ** 3))
+
+# Peak bytes per (point, point) pair: a curve holds about eight N x N arrays of distances,
+# orders and ranks; the metrics add the high-dimensional distances and the stress terms
+CURVE_BYTES_PER_PAIR = 32
+METRICS_BYTES_PER_PAIR = 56
+
+quality_executor = ThreadPoolExecutor(max_workers=QUALITY_WORKERS, thread_name_prefix="quality")
+
+
+class MemoryBudget:
+    """
+    Admits computations while their estimated peak memory fits in the budget,
+    so concurrency shrinks as datasets grow. One always runs, however large.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.reserved = 0
+        self._waiters: List[asyncio.Future] = []
+
+    async def acquire(self, nbytes: int):
+        while self.reserved and self.reserved + nbytes > self.budget:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.reserved += nbytes
+
+    def release(self, nbytes: int):
+        self.reserved -= nbytes
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+quality_memory = MemoryBudget(QUALITY_MEMORY_BUDGET)
+
+
+async def run_quality(bytes_per_pair: int, n_samples: int, fn, *args):
+    """
+    Runs fn(*args) on quality_executor once its N x N working memory fits the
+    budget. The reservation lasts until the thread is done, even if the caller
+    is cancelled while it runs, since the thread can't be stopped.
+    """
+    nbytes = bytes_per_pair * n_samples * n_samples
+    await quality_memory.acquire(nbytes)
+    loop = asyncio.get_running_loop()
+    try:
+        future = quality_executor.submit(fn, *args)
+    except BaseException:
+        quality_memory.release(nbytes)
+        raise
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(quality_memory.release, nbytes))
+    return await asyncio.wrap_future(future)
+
+
+def neighbour_order(X) -> np.ndarray:
+    """order[i, j] is the i-th nearest point to point j (itself first), as nxcurve ranks them."""
+    dtype = np.int32 if len(X) < 2 ** 31 else np.int64
+    return np.argsort(pairwise_distances(X), axis=0).astype(dtype)
+
+
+class HighDimRanks:
+    """
+    The high-dimensional half of nxcurve's co-ranking: the neighbour order of
+    every point in the original data. It never changes for a dataset, so it is
+    built once and each quality curve only has to rank the new embedding.
+    """
+
+    def __init__(self, X):
+        self.n_samples = len(X)
+        self.order = neighbour_order(X)
+
+    @property
+    def nbytes(self) -> int:
+        return self.order.nbytes
+
+
+def _rank_pairs(hd_order: np.ndarray, D_low: np.ndarray):
+    """
+    (HD rank, LD rank) of every (neighbour, point) pair, as N x N arrays:
+    row i holds each point's i-th nearest HD neighbour, ranks count self as 0.
+    """
+    n_samples = len(hd_order)
+    ld_rank = np.empty_like(hd_order)
+    positions = np.arange(n_samples, dtype=hd_order.dtype)
+    np.put_along_axis(ld_rank, np.argsort(D_low, axis=0).astype(hd_order.dtype), positions[:, None], axis=0)
+    hd = np.broadcast_to(positions[:, None], hd_order.shape)
+    ld = np.take_along_axis(ld_rank, hd_order, axis=0)
+    return hd, ld
+
+
+def _trusion(hd: np.ndarray, ld: np.ndarray):
+    """
+    Vectorized nxcurve.coranking + nx_trusion. Works on the (HD rank, LD rank)
+    pairs directly instead of materializing the co-ranking matrix.
+    """
+    n_samples = len(hd)
+    # nxcurve drops the first row and column, then indexes from 0
+    keep = (hd > 0) & (ld > 0)
+    k, l = hd[keep] - 1, ld[keep] - 1
+    rows = n_samples - 1
+    v1 = np.arange(1, rows + 1)
+    v2 = v1 * (rows + 1)
+
+    p = np.cumsum(np.bincount(k[k == l], minlength=rows)) / v2
+    n = np.cumsum(np.bincount(k[l < k], minlength=rows)) / v2  # intrusions, lower triangle
+    x = np.cumsum(np.bincount(l[k < l], minlength=rows)) / v2  # extrusions, upper triangle
+    b = v1 / rows
+    return n, x, p, b
+
+
+def quality_curve(ranks: HighDimRanks, X_low, opt: str = "r") -> Tuple[np.ndarray, float, str]:
+    """Same output as nxcurve.quality_curve(X, X_low, _, opt, False), reusing the cached HD ranks."""
+    if len(X_low) != ranks.n_samples:
+        raise ValueError(f"Expected {ranks.n_samples} points, got {len(X_low)}")
+    n, x, p, b = _trusion(*_rank_pairs(ranks.order, pairwise_distances(X_low)))
+    nmo = ranks.n_samples - 1
+    nmt = ranks.n_samples - 2
+
+    if opt == "r":
+        lcmc = n + x + p - b
+        curve = lcmc[:-1] / (1 - b[:-1])
+        weights = 1 / np.arange(1, nmt + 1)
+        name = "R_NX(K)"
+    elif opt == "q":
+        curve = n + x + p
+        weights = 1 / np.arange(1, nmo + 1)
+        name = "Q_NX(K)"
+    elif opt == "b":
+        curve = x - n
+        weights = 1 / np.arange(1, nmo + 1)
+        name = "B_NX(K)"
+    else:
+        raise ValueError("opt should be one of the following [q, b, r]")
+    return curve, float(np.dot(weights / weights.sum(), curve)), name
+
+
+def _rank_penalty(near: np.ndarray, far: np.ndarray, k: int) -> float:
+    """Sum over pairs within k on the near ranks but beyond k on the far ranks of (far rank - k)."""
+    missed = (near <= k) & (far > k) & (near > 0)
+    return float(np.sum(far[missed] - k, dtype=np.int64))
+
+
+def quality_metrics(ranks: HighDimRanks, X_high, X_low, ks: List[int]) -> Dict:
+    """
+    Trustworthiness, continuity and R_NX at each k, the R_NX curve and its AUC,
+    and normalized stress, all from one HD and one LD ranking.
+
+    Trustworthiness and continuity follow Venna & Kaski (sklearn's
+    trustworthiness, and the same with the roles of the spaces swapped).
+    Stress is Kruskal's stress-1 after scaling the embedding to best fit
+    the original distances, since embedding scales are arbitrary.
+    """
+    n_samples = ranks.n_samples
+    if len(X_low) != n_samples:
+        raise ValueError(f"Expected {n_samples} points, got {len(X_low)}")
+    for k in ks:
+        if not 1 <= k < n_samples / 2:
+            raise ValueError(f"k must be between 1 and {int(np.ceil(n_samples / 2)) - 1}, got {k}")
+
+    D_low = pairwise_distances(X_low)
+    hd, ld = _rank_pairs(ranks.order, D_low)
+
+    n, x, p, b = _trusion(hd, ld)
+    lcmc = n + x + p - b
+    rnx = lcmc[:-1] / (1 - b[:-1])
+    weights = 1 / np.arange(1, n_samples - 1)
+    auc = float(np.dot(weights / weights.sum(), rnx))
+
+    trustworthiness, continuity = [], []
+    for k in ks:
+        scale = 2.0 / (n_samples * k * (2.0 * n_samples - 3.0 * k - 1.0))
+        trustworthiness.append(1.0 - scale * _rank_penalty(ld, hd, k))
+        continuity.append(1.0 - scale * _rank_penalty(hd, ld, k))
+
+    D_high = pairwise_distances(X_high)
+    fit = np.sum(D_high * D_low) / max(np.sum(D_low ** 2), np.finfo(float).tiny)
+    stress = float(np.sqrt(np.sum((D_high - fit * D_low) ** 2) / max(np.sum(D_high ** 2), np.finfo(float).tiny)))
+
+    return {
+        "k": list(ks),
+        "trustworthiness": trustworthiness,
+        "continuity": continuity,
+        "rnx": [float(rnx[k - 1]) for k in ks],
+        "rnx_curve": rnx.tolist(),
+        "auc": auc,
+        "stress": stress,
+    }
@@ -0,0 +1,95 @@
+# app/services/session_store.py
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+import os
+import threading
+import time
+
+# Seconds after a user's last request for a dataset before their hold lapses
+DATASET_HOLD_TTL = float(os.getenv("DATASET_HOLD_TTL", 1800))
+
+
+class DatasetSessionManager:
+    """
+    Tracks which datasets each user holds, with a reference count per dataset,
+    so a dataset shared by several users is loaded and computed once.
+    Holds lapse after ttl seconds without a request from their user, since
+    users rarely release datasets explicitly (closing the tab is enough).
+    """
+
+    def __init__(self, ttl: float = DATASET_HOLD_TTL):
+        self.ttl = ttl
+        self._held: Dict[int, Set[str]] = {}
+        self._refs: Counter = Counter()
+        self._seen: Dict[Tuple[int, str], float] = {}  # (user_id, name) -> last request
+        self._lock = threading.Lock()
+
+    def hold(self, user_id: int, name: str, exclusive: bool = True) -> List[str]:
+        """
+        Records that user_id uses dataset name. With exclusive=True the user's
+        other datasets are released. Returns the datasets nobody holds anymore.
+        """
+        with self._lock:
+            held = self._held.setdefault(user_id, set())
+            self._seen[(user_id, name)] = time.monotonic()
+            if name not in held:
+                held.add(name)
+                self._refs[name] += 1
+            if not exclusive:
+                return []
+            released = []
+            for other in [other for other in held if other != name]:
+                if self._drop(user_id, other):
+                    released.append(other)
+            return released
+
+    def release(self, user_id: int, name: str) -> bool:
+        """Drops one user's hold on a dataset; True if that was the last reference."""
+        with self._lock:
+            return self._drop(user_id, name)
+
+    def touch(self, user_id: int, name: str) -> None:
+        """Keeps an existing hold alive; does nothing if the user doesn't hold name."""
+        with self._lock:
+            if name in self._held.get(user_id, ()):
+                self._seen[(user_id, name)] = time.monotonic()
+
+    def expire(self) -> List[str]:
+        """Drops the holds that lapsed; returns the datasets nobody holds anymore."""
+        deadline = time.monotonic() - self.ttl
+        with self._lock:
+            lapsed = [key for key, seen in self._seen.items() if seen < deadline]
+            return [name for user_id, name in lapsed if self._drop(user_id, name)]
+
+    def _drop(self, user_id: int, name: str) -> bool:
+        held = self._held.get(user_id, set())
+        if name not in held:
+            return False
+        held.discard(name)
+        self._seen.pop((user_id, name), None)
+        if not held:
+            self._held.pop(user_id, None)
+        self._refs[name] -= 1
+        if self._refs[name] <= 0:
+            del self._refs[name]
+            return True
+        return False
+
+    def refcount(self, name: str) -> int:
+        with self._lock:
+            return self._refs.get(name, 0)
+
+    def is_held(self, name: str) -> bool:
+        """True while some user's hold on name hasn't lapsed, even before expire() runs."""
+        deadline = time.monotonic() - self.ttl
+        with self._lock:
+            return any(name in held and self._seen.get((user_id, name), 0) >= deadline
+                       for user_id, held in self._held.items())
+
+    def held_by(self, user_id: int) -> List[str]:
+        with self._lock:
+            return sorted(self._held.get(user_id, set()))
+
+
+# Create a singleton instance
+dataset_sessions = DatasetSessionManager()
@@ -0,0 +1,145 @@
+# app/services/websocket_hub.py
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Union
+import asyncio
+import itertools
+import os
+from fastapi import WebSocket, status
+
+# Frames waiting for one client before it counts as stalled and is dropped
+HUB_QUEUE_SIZE = int(os.getenv("HUB_QUEUE_SIZE", 64))
+# Seconds a single send may take before the client is dropped
+HUB_SEND_TIMEOUT = float(os.getenv("HUB_SEND_TIMEOUT", 10))
+
+Frame = Union[str, bytes]
+
+
+class ClientConnection:
+    """
+    One socket's outgoing side: a bounded queue drained by its own writer task,
+    so a slow browser only ever delays itself.
+
+    Frames offered with a key replace a queued frame with the same key instead
+    of queueing behind it (latest status wins); a client whose queue is still
+    full is closed, and is expected to reconnect and refetch.
+    """
+
+    def __init__(self, hub: "WebSocketHub", websocket: WebSocket, max_queued: int = HUB_QUEUE_SIZE):
+        self.hub = hub
+        self.websocket = websocket
+        self.max_queued = max_queued
+        self.topics: Set[str] = set()  # empty: receives every topic
+        self.sent = 0
+        self.coalesced = 0
+        self._queue = OrderedDict()  # key -> frame, in send order
+        self._ready = asyncio.Event()
+        self._unique = itertools.count()
+        self._writer = asyncio.ensure_future(self._write())
+        self.closed = False
+
+    def offer(self, frame: Frame, key: Optional[str] = None) -> bool:
+        """Queues a frame without waiting; False if the client was dropped instead."""
+        if self.closed:
+            return False
+        if key is not None and key in self._queue:
+            # Sent where the newest one would have been, after anything it may depend on
+            self._queue[key] = frame
+            self._queue.move_to_end(key)
+            self.coalesced += 1
+            return True
+        if len(self._queue) >= self.max_queued:
+            print(f"🐢 Dropping slow WebSocket client ({len(self._queue)} frames queued)")
+            self.hub.unregister(self.websocket, code=status.WS_1013_TRY_AGAIN_LATER)
+            return False
+        self._queue[key if key is not None else next(self._unique)] = frame
+        self._ready.set()
+        return True
+
+    def wants(self, topic: Optional[str]) -> bool:
+        return topic is None or not self.topics or topic in self.topics
+
+    async def _write(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    _, frame = self._queue.popitem(last=False)
+                    send = self.websocket.send_bytes if isinstance(frame, bytes) else self.websocket.send_text
+                    await asyncio.wait_for(send(frame), timeout=HUB_SEND_TIMEOUT)
+                    self.sent += 1
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Disconnected, timed out or broken: either way nothing more can reach it
+            print(f"❌ Error notifying client: {e!r}")
+            self.hub.unregister(self.websocket)
+
+    def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._writer.cancel()
+        if code is not None:
+            asyncio.ensure_future(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+
+class WebSocketHub:
+    """
+    Connected clients and the dataset topics they follow. Broadcasts only queue
+    frames, so fan-out never waits on any one socket; every client's writer
+    sends concurrently. Clients that never subscribed receive every topic.
+    """
+
+    def __init__(self):
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.dropped = 0
+
+    def register(self, websocket: WebSocket) -> ClientConnection:
+        client = self.clients.get(websocket)
+        if client is None:
+            client = self.clients[websocket] = ClientConnection(self, websocket)
+        return client
+
+    def unregister(self, websocket: WebSocket, code: Optional[int] = None):
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            if code is not None:
+                self.dropped += 1
+            client.close(code)
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        self.clients[websocket].topics.update(topics)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        self.clients[websocket].topics.difference_update(topics)
+
+    def broadcast(self, frame: Frame, topic: Optional[str] = None, key: Optional[str] = None) -> int:
+        """Queues a frame for every client following topic (None: everyone); returns how many got it."""
+        delivered = 0
+        for client in list(self.clients.values()):
+            if client.wants(topic) and client.offer(frame, key):
+                delivered += 1
+        return delivered
+
+    def stats(self) -> Dict:
+        return {
+            "clients": len(self.clients),
+            "dropped": self.dropped,
+            "queued": sum(client.queued for client in self.clients.values()),
+        }
+
+
+hub = WebSocketHub()
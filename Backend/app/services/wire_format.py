@@ -0,0 +1,166 @@
+# app/services/wire_format.py
+
+from typing import Dict, List, Optional, Tuple
+import io
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+# Optional encoders; their media types are only offered when installed
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+RAW_FLOAT32 = "application/vnd.drbackend.float32"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+
+# Raw layout: magic, uint32 LE header length, UTF-8 JSON header padded to 8 bytes,
+# then the buffers, each starting at an 8-byte aligned offset from the body start
+RAW_MAGIC = b"DRB1"
+_ALIGN = 8
+
+_ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+def available_media_types() -> List[str]:
+    types = [JSON, RAW_FLOAT32]
+    if pa is not None:
+        types.append(ARROW)
+    if msgpack is not None:
+        types.append(MSGPACK)
+    return types
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Picks the response media type from an Accept header. JSON is the default and
+    what wildcards resolve to; returns None if nothing acceptable is available.
+    """
+    if not accept:
+        return JSON
+    offered = available_media_types()
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_range, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, position, _ALIASES.get(media_range.lower(), media_range.lower())))
+    for negative_quality, _, media_range in sorted(ranges):
+        if negative_quality == 0:
+            break  # q=0 means "not acceptable"
+        if media_range in ("*/*", "application/*"):
+            return JSON
+        if media_range in offered:
+            return media_range
+    return None
+
+
+def encode_labels(y) -> Tuple[np.ndarray, list]:
+    """Dictionary-encodes labels: int32 codes plus the distinct labels in order of first appearance."""
+    # Missing labels get a code of their own rather than -1, named null: NaN is not valid JSON
+    codes, names = pd.factorize(pd.Series(y), sort=False, use_na_sentinel=False)
+    return codes.astype(np.int32), [None if pd.isna(name) else name for name in names.tolist()]
+
+
+def encode(media_type: str, meta: Dict, arrays: Dict[str, np.ndarray], labels=None) -> bytes:
+    """
+    Encodes a response: meta is JSON-serializable, arrays maps names to (N, d)
+    float arrays sent as float32, labels is an optional (codes, names) pair.
+    """
+    arrays = {name: np.ascontiguousarray(data, dtype="<f4") for name, data in arrays.items()}
+    if media_type == RAW_FLOAT32:
+        return _encode_raw(meta, arrays, labels)
+    if media_type == ARROW:
+        return _encode_arrow(meta, arrays, labels)
+    if media_type == MSGPACK:
+        return _encode_msgpack(meta, arrays, labels)
+    raise ValueError(f"Unsupported media type: {media_type}")
+
+
+def _encode_raw(meta, arrays, labels) -> bytes:
+    buffers = list(arrays.items())
+    if labels is not None:
+        buffers.append(("labels", labels[0].astype("<i4")))
+    descriptors, offset = [], 0
+    for name, data in buffers:
+        descriptors.append({"name": name, "dtype": data.dtype.str, "shape": list(data.shape), "offset": offset})
+        offset += _padded(data.nbytes)
+    header = {"meta": meta, "buffers": descriptors}
+    if labels is not None:
+        header["label_names"] = labels[1]
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (_padded(len(RAW_MAGIC) + 4 + len(header_bytes)) - len(RAW_MAGIC) - 4 - len(header_bytes))
+
+    out = io.BytesIO()
+    out.write(RAW_MAGIC)
+    out.write(struct.pack("<I", len(header_bytes)))
+    out.write(header_bytes)
+    for _, data in buffers:
+        out.write(data.tobytes())
+        out.write(b"\0" * (_padded(data.nbytes) - data.nbytes))
+    return out.getvalue()
+
+
+def _encode_arrow(meta, arrays, labels) -> bytes:
+    columns, names = [], []
+    for name, data in arrays.items():
+        columns.append(pa.FixedSizeListArray.from_arrays(pa.array(data.reshape(-1)), data.shape[1]))
+        names.append(name)
+    if labels is not None:
+        columns.append(pa.DictionaryArray.from_arrays(pa.array(labels[0]), pa.array(labels[1])))
+        names.append("labels")
+    schema_metadata = {"meta": json.dumps(meta)}
+    # A projections-only response has columns of N rows too; an empty one is just the schema
+    table = pa.Table.from_arrays(columns, names=names, metadata=schema_metadata) if columns \
+        else pa.table({}).replace_schema_metadata(schema_metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_msgpack(meta, arrays, labels) -> bytes:
+    body = {
+        "meta": meta,
+        "arrays": {
+            name: {"dtype": data.dtype.str, "shape": list(data.shape), "data": data.tobytes()}
+            for name, data in arrays.items()
+        },
+    }
+    if labels is not None:
+        body["labels"] = {"codes": labels[0].astype("<i4").tobytes(), "names": labels[1]}
+    return msgpack.packb(body, use_bin_type=True)
+
+
+def decode_raw(blob: bytes) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Inverse of the raw encoding, for tests and Python clients."""
+    if blob[:4] != RAW_MAGIC:
+        raise ValueError("Not a raw float32 payload")
+    (header_length,) = struct.unpack("<I", blob[4:8])
+    header = json.loads(blob[8:8 + header_length])
+    body = memoryview(blob)[8 + header_length:]
+    arrays = {}
+    for buffer in header["buffers"]:
+        dtype = np.dtype(buffer["dtype"])
+        count = int(np.prod(buffer["shape"]))
+        arrays[buffer["name"]] = np.frombuffer(body, dtype=dtype, count=count,
+                                               offset=buffer["offset"]).reshape(buffer["shape"])
+    return header, arrays
+
+
+def _padded(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
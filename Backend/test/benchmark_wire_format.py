@@ -0,0 +1,59 @@
+# Compares the JSON dataset payload with the binary encodings of app/services/wire_format.py
+# Run from Backend: PYTHONPATH=. python test/benchmark_wire_format.py [n_points ...]
+import sys
+import time
+import numpy as np
+from fastapi.responses import JSONResponse
+from app.api.dataset import _dataset_response, _binary_parts
+from app.services import wire_format
+from app.services.dataset_store import Dataset
+from app.services.projection_engine import ALGORITHMS, DIMENSIONS
+
+
+def make_dataset(n_points):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(n_points, 3)).tolist()
+    y = [f"class_{i}" for i in rng.integers(0, 8, n_points)]
+    dataset = Dataset("benchmark.csv", X, y, defer_computation=True)
+    # Random projections stand in for fitted ones; only their size matters here
+    dataset.load_projections({
+        mix_type: {
+            dim: {name: rng.normal(size=(n_points, n)) for mix, name in ALGORITHMS if mix == mix_type}
+            for dim, n in DIMENSIONS.items()
+        }
+        for mix_type in ("kernel", "reduced")
+    })
+    return dataset
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(sizes):
+    for n_points in sizes:
+        dataset = make_dataset(n_points)
+        print(f"\n{n_points} points")
+        print(f"{'format':<40}{'encode ms':>12}{'size KB':>12}")
+
+        seconds, body = timed(lambda: JSONResponse(_dataset_response(dataset)).body)
+        print(f"{wire_format.JSON:<40}{seconds * 1000:>12.1f}{len(body) / 1024:>12.0f}")
+
+        for media_type in wire_format.available_media_types():
+            if media_type == wire_format.JSON:
+                continue
+            seconds, body = timed(lambda: wire_format.encode(media_type, *_binary_parts(dataset, True)))
+            print(f"{media_type:<40}{seconds * 1000:>12.1f}{len(body) / 1024:>12.0f}")
+
+        raw = wire_format.encode(wire_format.RAW_FLOAT32, *_binary_parts(dataset, True))
+        seconds, _ = timed(lambda: wire_format.decode_raw(raw))
+        print(f"raw float32 decode: {seconds * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [2400, 20000])
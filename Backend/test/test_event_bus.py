@@ -0,0 +1,69 @@
+# Tests for app/services/event_bus.py
+# Run from Backend: python -m pytest -q test
+import asyncio
+import pytest
+
+from app.services.event_bus import EventBus, LocalEventBus, MemoryEventBus, PostgresEventBus
+
+
+def _collector():
+    received = []
+    return received, lambda channel, event, key: received.append((channel, event, key))
+
+
+def test_buses_on_a_shared_broker_all_deliver():
+    async def run():
+        broker = []
+        worker_a, worker_b = MemoryEventBus(broker), MemoryEventBus(broker)
+        received_a, deliver_a = _collector()
+        received_b, deliver_b = _collector()
+        await worker_a.start(deliver_a)
+        await worker_b.start(deliver_b)
+
+        worker_a.publish("projections", {"type": "projections_ready", "dataset": "a.csv"})
+        # Published from a compute thread, like projection notifications
+        await asyncio.to_thread(worker_b.publish, "forum", {"type": "thread_created", "thread_id": 1}, "t1")
+        await asyncio.sleep(0)
+
+        expected = [
+            ("projections", {"type": "projections_ready", "dataset": "a.csv"}, None),
+            ("forum", {"type": "thread_created", "thread_id": 1}, "t1"),
+        ]
+        assert received_a == expected
+        assert received_b == expected
+        assert len(worker_a.messages) == len(worker_b.messages) == 2
+
+    asyncio.run(run())
+
+
+def test_local_bus_delivers_to_its_own_loop():
+    async def run():
+        bus = LocalEventBus()
+        received, deliver = _collector()
+        await bus.start(deliver)
+        await asyncio.to_thread(bus.publish, "progress", {"id": "x"})
+        await asyncio.sleep(0)
+        assert received == [("progress", {"id": "x"}, None)]
+
+    asyncio.run(run())
+
+
+def test_unstarted_bus_drops_events():
+    bus = MemoryEventBus()
+    bus.publish("progress", {"id": "x"})
+    assert bus.delivered == 0 and len(bus.messages) == 1
+
+
+def test_unknown_channel_is_rejected():
+    with pytest.raises(ValueError):
+        LocalEventBus().publish("chat", {})
+
+
+def test_event_bus_is_abstract():
+    with pytest.raises(TypeError):
+        EventBus()
+
+
+def test_postgres_bus_requires_a_url():
+    with pytest.raises(ValueError):
+        PostgresEventBus(None)
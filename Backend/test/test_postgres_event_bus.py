@@ -0,0 +1,167 @@
+# Tests for the Postgres backend of app/services/event_bus.py, against an in-process fake of psycopg2
+# Run from Backend: python -m pytest -q test
+import asyncio
+import socket
+
+import pytest
+
+from app.services import event_bus as event_bus_module
+from app.services.event_bus import PostgresEventBus
+
+
+class FakeNotify:
+    def __init__(self, channel, payload):
+        self.channel = channel
+        self.payload = payload
+
+
+class FakePostgres:
+    """One database: pg_notify reaches every connection listening on the channel."""
+
+    def __init__(self):
+        self.listening = []  # (channel, connection)
+        self.notified = 0
+        self.down = False
+
+    def connect(self):
+        if self.down:
+            raise ConnectionError("database unreachable")
+        return FakeConnection(self)
+
+    def notify(self, channel, payload):
+        self.notified += 1
+        for listen_channel, connection in list(self.listening):
+            if listen_channel == channel and not connection.closed:
+                connection.deliver(FakeNotify(channel, payload))
+
+
+class FakeConnection:
+    """Like a psycopg2 connection: a readable socket whenever notifications are pending."""
+
+    def __init__(self, server):
+        self.server = server
+        self.autocommit = False
+        self.closed = False
+        self.notifies = []
+        self._pending = []
+        self._socket, self._peer = socket.socketpair()
+
+    def deliver(self, notify):
+        self._pending.append(notify)
+        self._peer.send(b"!")
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def poll(self):
+        self._socket.recv(4096)
+        self.notifies.extend(self._pending)
+        self._pending.clear()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+        self._socket.close()
+        self._peer.close()
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if sql.startswith("LISTEN"):
+            self.connection.server.listening.append((sql.split('"')[1], self.connection))
+        elif "pg_notify" in sql:
+            self.connection.server.notify(*params)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakePostgres()
+    monkeypatch.setattr(PostgresEventBus, "_connect", lambda self: server.connect())
+    return server
+
+
+def _collector():
+    received = []
+    return received, lambda channel, event, key: received.append((channel, event, key))
+
+
+async def _until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out waiting for delivery"
+        await asyncio.sleep(0.01)
+
+
+def test_publish_reaches_every_worker_through_notify(server):
+    async def run():
+        worker_a = PostgresEventBus("postgresql://events", channel="events")
+        worker_b = PostgresEventBus("postgresql://events", channel="events")
+        received_a, deliver_a = _collector()
+        received_b, deliver_b = _collector()
+        await worker_a.start(deliver_a)
+        await worker_b.start(deliver_b)
+        try:
+            worker_a.publish("progress", {"type": "blend_optimization", "id": "x"}, "blend_optimization:x")
+            await _until(lambda: received_a and received_b)
+        finally:
+            await worker_a.stop()
+            await worker_b.stop()
+
+        expected = [("progress", {"type": "blend_optimization", "id": "x"}, "blend_optimization:x")]
+        # Delivered once per worker, the publishing one included, only via NOTIFY
+        assert received_a == expected and received_b == expected
+        assert server.notified == 1
+
+    asyncio.run(run())
+
+
+def test_oversized_event_stays_on_the_publishing_worker(server, monkeypatch):
+    monkeypatch.setattr(event_bus_module, "_POSTGRES_MAX_PAYLOAD", 100)
+
+    async def run():
+        worker_a = PostgresEventBus("postgresql://events")
+        worker_b = PostgresEventBus("postgresql://events")
+        received_a, deliver_a = _collector()
+        received_b, deliver_b = _collector()
+        await worker_a.start(deliver_a)
+        await worker_b.start(deliver_b)
+        try:
+            worker_a.publish("projections", {"type": "projection_added", "dataset": "x" * 200})
+            await _until(lambda: received_a)
+            await asyncio.sleep(0.05)
+        finally:
+            await worker_a.stop()
+            await worker_b.stop()
+
+        assert len(received_a) == 1 and received_b == []
+        assert server.notified == 0
+
+    asyncio.run(run())
+
+
+def test_unreachable_database_still_delivers_locally(server):
+    async def run():
+        bus = PostgresEventBus("postgresql://events")
+        received, deliver = _collector()
+        await bus.start(deliver)
+        server.down = True
+        try:
+            bus.publish("forum", {"type": "thread_created", "thread_id": 1})
+            await _until(lambda: received)
+        finally:
+            await bus.stop()
+
+        assert received == [("forum", {"type": "thread_created", "thread_id": 1}, None)]
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+# Regression tests for app/services/rank_quality.py against the reference implementations
+# Run from Backend: python -m pytest -q test
+import numpy as np
+import pytest
+from nxcurve import quality_curve as nx_quality_curve
+from sklearn.manifold import trustworthiness
+
+from app.services.rank_quality import HighDimRanks, quality_curve, quality_metrics
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(150, 5))
+    X_low = X[:, :2] + 0.3 * rng.normal(size=(150, 2))
+    return X, X_low, HighDimRanks(X)
+
+
+@pytest.mark.parametrize("opt", ["r", "q", "b"])
+def test_quality_curve_matches_nxcurve(data, opt):
+    X, X_low, ranks = data
+    expected_curve, expected_auc, expected_name = nx_quality_curve(X, X_low, 20, opt, False)
+    curve, auc, name = quality_curve(ranks, X_low, opt)
+    assert name == expected_name
+    np.testing.assert_allclose(curve, expected_curve, rtol=0, atol=1e-12)
+    assert auc == pytest.approx(expected_auc, abs=1e-12)
+
+
+def test_quality_curve_rejects_wrong_size(data):
+    _, X_low, ranks = data
+    with pytest.raises(ValueError):
+        quality_curve(ranks, X_low[:-1])
+
+
+def test_trustworthiness_matches_sklearn(data):
+    X, X_low, ranks = data
+    ks = [5, 10, 20]
+    metrics = quality_metrics(ranks, X, X_low, ks)
+    for k, value in zip(ks, metrics["trustworthiness"]):
+        assert value == pytest.approx(trustworthiness(X, X_low, n_neighbors=k), abs=1e-4)
+
+
+def test_continuity_is_trustworthiness_with_spaces_swapped(data):
+    X, X_low, ranks = data
+    metrics = quality_metrics(HighDimRanks(X_low), X_low, X, [10])
+    assert metrics["continuity"][0] == pytest.approx(quality_metrics(ranks, X, X_low, [10])["trustworthiness"][0])
+
+
+def test_metrics_auc_matches_quality_curve(data):
+    X, X_low, ranks = data
+    _, auc, _ = quality_curve(ranks, X_low, "r")
+    assert quality_metrics(ranks, X, X_low, [10])["auc"] == pytest.approx(auc, abs=1e-12)
+
+
+def test_metrics_reject_k_out_of_range(data):
+    X, X_low, ranks = data
+    with pytest.raises(ValueError):
+        quality_metrics(ranks, X, X_low, [len(X)])